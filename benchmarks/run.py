@@ -0,0 +1,272 @@
+# Benchmarks for the STIX decoder and the TAXII miner.
+#
+# python -m benchmarks.run --packages 200 --observables 100 --output bench.ndjson
+#
+# Every benchmark runs in its own process, results are printed as
+# one JSON object per line (and appended to --output if set) so runs
+# can be compared over time.
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+from benchmarks.stixgen import generate_packages, DEFAULT_MIX
+from benchmarks.taxiiserver import TAXIIServer
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_decode(args):
+    import taxiing.stix
+
+    packages = generate_packages(
+        packages=args.packages,
+        observables=args.observables,
+        mix=args.mix,
+        related_depth=args.related_depth
+    )
+
+    start = time.time()
+    indicators = 0
+    for p in packages:
+        indicators += len(taxiing.stix.decode(p, **args.decode_options)[1])
+    elapsed = time.time()-start
+
+    return dict(
+        packages=len(packages),
+        indicators=indicators,
+        bytes=sum(len(p) for p in packages),
+        elapsed=elapsed
+    )
+
+
+def bench_process_item(args):
+    # per indicator cost of Miner._process_item and number of distinct
+    # string objects referenced by the emitted attribute dicts
+    os.environ.setdefault('MM_CONFIG_DIR', tempfile.mkdtemp())
+    import taxiing.stix
+    from taxiing.node import Miner
+
+    packages = generate_packages(
+        packages=args.packages,
+        observables=args.observables,
+        mix=args.mix,
+        related_depth=args.related_depth
+    )
+    items = []
+    for p in packages:
+        items.extend(taxiing.stix.decode(p)[1])
+
+    config = dict(prefix='bench')
+    config.update(args.miner_config)
+    miner = Miner('bench', None, config)
+
+    start = time.time()
+    processed = [miner._process_item(item) for item in items]
+    elapsed = time.time()-start
+
+    strings = set()
+    for [[_, value]] in processed:
+        for k, v in value.iteritems():
+            strings.add(id(k))
+            if isinstance(v, basestring):
+                strings.add(id(v))
+
+    return dict(
+        packages=len(packages),
+        indicators=len(items),
+        bytes=sum(len(p) for p in packages),
+        elapsed=elapsed,
+        usec_per_indicator=elapsed*1e6/max(len(items), 1),
+        strings_per_indicator=float(len(strings))/max(len(items), 1)
+    )
+
+
+class _HubTicker(object):
+    # longest time the gevent hub could not run other greenlets,
+    # MineMeld runs all the nodes of an engine in one process
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_gap = 0.0
+        self.last = None
+        self.glet = None
+
+    def _run(self):
+        import gevent
+
+        while True:
+            gevent.sleep(self.interval)
+            self._tick()
+
+    def _tick(self):
+        now = time.time()
+        self.max_gap = max(self.max_gap, now-self.last-self.interval)
+        self.last = now
+
+    def start(self):
+        import gevent
+
+        self.last = time.time()
+        self.glet = gevent.spawn(self._run)
+
+    def stop(self):
+        self.glet.kill()
+        self._tick()
+
+
+def bench_miner(args):
+    # same patching of the MineMeld engine
+    from gevent import monkey
+    monkey.patch_all(thread=False, select=False)
+
+    os.environ.setdefault('MM_CONFIG_DIR', tempfile.mkdtemp())
+    from taxiing.node import Miner
+
+    packages = generate_packages(
+        packages=args.packages,
+        observables=args.observables,
+        mix=args.mix,
+        related_depth=args.related_depth
+    )
+    server = TAXIIServer(
+        packages,
+        blocks_per_part=args.blocks_per_part,
+        compress=args.compress
+    ).start()
+
+    config = dict(
+        discovery_service=server.discovery_service,
+        collection=server.collection,
+        initial_interval=3600,
+        max_poll_dt=86400
+    )
+    config.update(args.miner_config)
+    miner = Miner('bench', None, config)
+
+    ticker = _HubTicker()
+    ticker.start()
+    try:
+        start = time.time()
+        indicators = 0
+        for item in miner._build_iterator(int(time.time()*1000)):
+            indicators += len(miner._process_item(item))
+        elapsed = time.time()-start
+
+    finally:
+        ticker.stop()
+        miner._terminate_decode_pool()
+        server.stop()
+
+    return dict(
+        packages=len(packages),
+        indicators=indicators,
+        bytes=server.bytes_sent,
+        elapsed=elapsed,
+        max_hub_gap=ticker.max_gap
+    )
+
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'miner': bench_miner,
+    'process_item': bench_process_item
+}
+
+
+def _run_child(name, args, queue):
+    try:
+        result = BENCHMARKS[name](args)
+        result['peak_rss_kb'] = _peak_rss_kb()
+        queue.put(result)
+
+    except Exception as e:
+        queue.put(dict(error='{}: {}'.format(type(e).__name__, e)))
+
+
+def run(name, args):
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_run_child, args=(name, args, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+
+    result.update(
+        benchmark=name,
+        timestamp=int(time.time()),
+        params=dict(
+            packages=args.packages,
+            observables=args.observables,
+            related_depth=args.related_depth,
+            mix=args.mix,
+            blocks_per_part=args.blocks_per_part,
+            compress=args.compress,
+            decode_options=args.decode_options,
+            miner_config=args.miner_config
+        )
+    )
+
+    elapsed = result.get('elapsed', None)
+    if elapsed:
+        result['packages_per_sec'] = result['packages']/elapsed
+        result['indicators_per_sec'] = result['indicators']/elapsed
+        result['bytes_per_sec'] = result['bytes']/elapsed
+
+    return result
+
+
+def _parse_mix(value):
+    mix = {}
+    for entry in value.split(','):
+        type_, weight = entry.split('=', 1)
+        if type_ not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('unknown object type {!r}'.format(type_))
+        mix[type_] = float(weight)
+
+    return mix
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='minemeld-taxii-ng benchmarks')
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS.keys()),
+                        help='benchmarks to run: {}'.format(', '.join(sorted(BENCHMARKS.keys()))))
+    parser.add_argument('--packages', type=int, default=100, help='number of STIX packages')
+    parser.add_argument('--observables', type=int, default=100, help='observables per package')
+    parser.add_argument('--related-depth', type=int, default=0, help='depth of related objects')
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX,
+                        help='object type weights, e.g. ipv4=4,domain=1,file=1')
+    parser.add_argument('--blocks-per-part', type=int, default=50, help='content blocks per poll response part')
+    parser.add_argument('--compress', action='store_true', help='gzip poll responses when asked by the miner')
+    parser.add_argument('--decode-options', type=json.loads, default={},
+                        help='decode keyword arguments, as JSON, e.g. {"ip_version_auto_detect": true}')
+    parser.add_argument('--miner-config', type=json.loads, default={}, help='extra miner config, as JSON')
+    parser.add_argument('--output', default=None, help='append results to this file')
+
+    args = parser.parse_args(argv)
+    for b in args.benchmarks:
+        if b not in BENCHMARKS:
+            parser.error('unknown benchmark {!r}'.format(b))
+
+    return args
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    for name in args.benchmarks:
+        result = json.dumps(run(name, args), sort_keys=True)
+        print result
+
+        if args.output is not None:
+            with open(args.output, 'a') as f:
+                f.write(result+'\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import random
+import uuid
+
+from lxml import etree
+
+NAMESPACES = {
+    'stix': 'http://stix.mitre.org/stix-1',
+    'stixCommon': 'http://stix.mitre.org/common-1',
+    'cybox': 'http://cybox.mitre.org/cybox-2',
+    'cyboxCommon': 'http://cybox.mitre.org/common-2',
+    'marking': 'http://data-marking.mitre.org/Marking-1',
+    'tlpMarking': 'http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1',
+    'AddressObj': 'http://cybox.mitre.org/objects#AddressObject-2',
+    'DomainNameObj': 'http://cybox.mitre.org/objects#DomainNameObject-1',
+    'URIObj': 'http://cybox.mitre.org/objects#URIObject-2',
+    'FileObj': 'http://cybox.mitre.org/objects#FileObject-2',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+    'bench': 'http://example.com/bench'
+}
+
+# relative weight of each object type in the generated packages
+DEFAULT_MIX = {
+    'ipv4': 4,
+    'ipv6': 1,
+    'email': 1,
+    'domain': 2,
+    'url': 2,
+    'file': 1
+}
+
+
+def _q(tag):
+    prefix, name = tag.split(':', 1)
+    return '{{{}}}{}'.format(NAMESPACES[prefix], name)
+
+
+def _sub(parent, tag, text=None, **attrs):
+    e = etree.SubElement(parent, _q(tag))
+    for k, v in attrs.iteritems():
+        if ':' in k:
+            k = _q(k)
+        e.set(k, v)
+    if text is not None:
+        e.text = text
+
+    return e
+
+
+def _properties(parent, type_, rnd):
+    if type_ == 'ipv4':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'AddressObj:AddressObjectType', 'category': 'ipv4-addr'})
+        _sub(props, 'AddressObj:Address_Value', '{}.{}.{}.{}'.format(*[rnd.randint(1, 254) for _ in range(4)]))
+
+    elif type_ == 'ipv6':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'AddressObj:AddressObjectType', 'category': 'ipv6-addr'})
+        _sub(props, 'AddressObj:Address_Value', '2001:db8::{:x}:{:x}'.format(rnd.getrandbits(16), rnd.getrandbits(16)))
+
+    elif type_ == 'email':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'AddressObj:AddressObjectType', 'category': 'e-mail'})
+        _sub(props, 'AddressObj:Address_Value', 'user{}@example{}.com'.format(rnd.getrandbits(24), rnd.getrandbits(8)))
+
+    elif type_ == 'domain':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'DomainNameObj:DomainNameObjectType', 'type': 'FQDN'})
+        _sub(props, 'DomainNameObj:Value', 'host{}.example{}.com'.format(rnd.getrandbits(24), rnd.getrandbits(8)))
+
+    elif type_ == 'url':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'URIObj:URIObjectType', 'type': 'URL'})
+        _sub(props, 'URIObj:Value', 'http://host{}.example.com/{:x}'.format(rnd.getrandbits(24), rnd.getrandbits(64)))
+
+    elif type_ == 'file':
+        props = _sub(parent, 'cybox:Properties', **{'xsi:type': 'FileObj:FileObjectType'})
+        _sub(props, 'FileObj:File_Name', 'sample{}.exe'.format(rnd.getrandbits(16)))
+        _sub(props, 'FileObj:File_Size', str(rnd.getrandbits(20)))
+        hashes = _sub(props, 'FileObj:Hashes')
+        for htype, bits in [('MD5', 128), ('SHA1', 160), ('SHA256', 256)]:
+            h = _sub(hashes, 'cyboxCommon:Hash')
+            _sub(h, 'cyboxCommon:Type', htype)
+            _sub(h, 'cyboxCommon:Simple_Hash_Value', '{:0{}x}'.format(rnd.getrandbits(bits), bits/4))
+
+    else:
+        raise ValueError('Unknown object type {!r}'.format(type_))
+
+    return props
+
+
+def _related_objects(obj, depth, mix, rnd):
+    if depth <= 0:
+        return
+
+    robjs = _sub(obj, 'cybox:Related_Objects')
+    robj = _sub(robjs, 'cybox:Related_Object', id='bench:Object-{}'.format(uuid.UUID(int=rnd.getrandbits(128))))
+    _properties(robj, _choose(mix, rnd), rnd)
+    _sub(robj, 'cybox:Relationship', 'Related_To')
+    _related_objects(robj, depth-1, mix, rnd)
+
+
+def _choose(mix, rnd):
+    total = sum(mix.values())
+    n = rnd.uniform(0, total)
+    for type_, weight in sorted(mix.items()):
+        n -= weight
+        if n <= 0:
+            return type_
+
+    return type_
+
+
+def generate_package(observables=100, mix=None, related_depth=0, seed=None, timestamp='2017-11-06T12:12:19.000000+00:00'):
+    if mix is None:
+        mix = DEFAULT_MIX
+    rnd = random.Random(seed)
+
+    package = etree.Element(
+        _q('stix:STIX_Package'),
+        nsmap=NAMESPACES,
+        id='bench:Package-{}'.format(uuid.UUID(int=rnd.getrandbits(128))),
+        version='1.1.1',
+        timestamp=timestamp
+    )
+
+    header = _sub(package, 'stix:STIX_Header')
+    _sub(header, 'stix:Title', 'Benchmark package')
+    _sub(header, 'stix:Description', 'Synthetic package generated for benchmarks. ' * 8)
+    handling = _sub(header, 'stix:Handling')
+    marking = _sub(handling, 'marking:Marking')
+    _sub(marking, 'marking:Marking_Structure', **{'xsi:type': 'tlpMarking:TLPMarkingStructureType', 'color': 'AMBER'})
+    isource = _sub(header, 'stix:Information_Source')
+    identity = _sub(isource, 'stixCommon:Identity')
+    _sub(identity, 'stixCommon:Name', 'Benchmark')
+
+    os_ = _sub(package, 'stix:Observables', cybox_major_version='2', cybox_minor_version='1')
+    for n in range(observables):
+        o = _sub(os_, 'cybox:Observable', id='bench:Observable-{}'.format(uuid.UUID(int=rnd.getrandbits(128))))
+        _sub(o, 'cybox:Title', 'Observable {}'.format(n))
+        _sub(o, 'cybox:Description', 'Synthetic observable {}'.format(n))
+        obj = _sub(o, 'cybox:Object', id='bench:Object-{}'.format(uuid.UUID(int=rnd.getrandbits(128))))
+        _properties(obj, _choose(mix, rnd), rnd)
+        _related_objects(obj, related_depth, mix, rnd)
+
+    return etree.tostring(package)
+
+
+def generate_packages(packages=100, seed=0, **kwargs):
+    rnd = random.Random(seed)
+
+    return [
+        generate_package(seed=rnd.getrandbits(64), **kwargs)
+        for _ in range(packages)
+    ]
@@ -0,0 +1,211 @@
+import uuid
+import zlib
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from lxml import etree
+
+from taxiing.taxii import v11 as taxii11
+
+NSMAP = 'xmlns:taxii_11="{}"'.format(taxii11.NAMESPACE)
+
+DISCOVERY_RESPONSE = '''<taxii_11:Discovery_Response {nsmap} message_id="{message_id}" in_response_to="{in_response_to}">
+    <taxii_11:Service_Instance service_type="COLLECTION_MANAGEMENT" service_version="urn:taxii.mitre.org:services:1.1" available="true">
+        <taxii_11:Protocol_Binding>urn:taxii.mitre.org:protocol:http:1.0</taxii_11:Protocol_Binding>
+        <taxii_11:Address>{base_url}/taxii-collection-management-service</taxii_11:Address>
+        <taxii_11:Message_Binding>urn:taxii.mitre.org:message:xml:1.1</taxii_11:Message_Binding>
+    </taxii_11:Service_Instance>
+    <taxii_11:Service_Instance service_type="POLL" service_version="urn:taxii.mitre.org:services:1.1" available="true">
+        <taxii_11:Protocol_Binding>urn:taxii.mitre.org:protocol:http:1.0</taxii_11:Protocol_Binding>
+        <taxii_11:Address>{base_url}/taxii-poll-service</taxii_11:Address>
+        <taxii_11:Message_Binding>urn:taxii.mitre.org:message:xml:1.1</taxii_11:Message_Binding>
+    </taxii_11:Service_Instance>
+</taxii_11:Discovery_Response>'''
+
+COLLECTION_INFORMATION_RESPONSE = '''<taxii_11:Collection_Information_Response {nsmap} message_id="{message_id}" in_response_to="{in_response_to}">
+    <taxii_11:Collection collection_name="{collection}" collection_type="DATA_FEED" available="true">
+        <taxii_11:Description>Benchmark collection</taxii_11:Description>
+        <taxii_11:Polling_Service>
+            <taxii_11:Protocol_Binding>urn:taxii.mitre.org:protocol:http:1.0</taxii_11:Protocol_Binding>
+            <taxii_11:Address>{base_url}/taxii-poll-service</taxii_11:Address>
+            <taxii_11:Message_Binding>urn:taxii.mitre.org:message:xml:1.1</taxii_11:Message_Binding>
+        </taxii_11:Polling_Service>
+    </taxii_11:Collection>
+</taxii_11:Collection_Information_Response>'''
+
+POLL_RESPONSE_HEADER = '''<taxii_11:Poll_Response {nsmap} message_id="{message_id}" in_response_to="{in_response_to}" collection_name="{collection}" more="{more}" result_id="{result_id}" result_part_number="{result_part_number}">
+    <taxii_11:Inclusive_End_Timestamp>{end}</taxii_11:Inclusive_End_Timestamp>
+    <taxii_11:Record_Count partial_count="false">{record_count}</taxii_11:Record_Count>'''
+
+CONTENT_BLOCK = '''
+    <taxii_11:Content_Block>
+        <taxii_11:Content_Binding binding_id="urn:stix.mitre.org:xml:1.1.1"/>
+        <taxii_11:Content>{content}</taxii_11:Content>
+        <taxii_11:Timestamp_Label>{timestamp_label}</taxii_11:Timestamp_Label>
+    </taxii_11:Content_Block>'''
+
+POLL_RESPONSE_FOOTER = '''
+</taxii_11:Poll_Response>'''
+
+STATUS_MESSAGE = '''<taxii_11:Status_Message {nsmap} message_id="{message_id}" in_response_to="{in_response_to}" status_type="{status_type}"/>'''
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _TAXIIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _message(self, request, template, **kwargs):
+        return template.format(
+            nsmap=NSMAP,
+            message_id=taxii11.new_message_id(),
+            in_response_to=request.get('message_id'),
+            base_url=self.server.taxii.base_url,
+            collection=self.server.taxii.collection,
+            **kwargs
+        )
+
+    def _send(self, chunks):
+        compressor = None
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and self.server.taxii.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', taxii11.MESSAGE_BINDING)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if compressor is not None:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            self._write_chunk(chunk)
+
+        if compressor is not None:
+            self._write_chunk(compressor.flush())
+        self.wfile.write('0\r\n\r\n')
+
+    def _write_chunk(self, chunk):
+        if len(chunk) == 0:
+            return
+
+        self.server.taxii.add_bytes_sent(len(chunk))
+        self.wfile.write('{:x}\r\n'.format(len(chunk)))
+        self.wfile.write(chunk)
+        self.wfile.write('\r\n')
+
+    def do_POST(self):
+        request = etree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        message = request.tag.rsplit('}', 1)[-1]
+
+        if message == 'Discovery_Request':
+            self._send([self._message(request, DISCOVERY_RESPONSE)])
+
+        elif message == 'Collection_Information_Request':
+            self._send([self._message(request, COLLECTION_INFORMATION_RESPONSE)])
+
+        elif message == 'Poll_Request':
+            end = request.findtext('{{{}}}Inclusive_End_Timestamp'.format(taxii11.NAMESPACE))
+            result_id = self.server.taxii.new_result(end)
+            self._send(self._poll_response(request, result_id, 1))
+
+        elif message == 'Poll_Fulfillment':
+            result_id = request.get('result_id')
+            result_part_number = int(request.get('result_part_number'))
+            if result_id not in self.server.taxii.results or \
+               result_part_number > self.server.taxii.num_parts:
+                self._send([self._message(request, STATUS_MESSAGE, status_type='NOT_FOUND')])
+                return
+            self._send(self._poll_response(request, result_id, result_part_number))
+
+        else:
+            self._send([self._message(request, STATUS_MESSAGE, status_type='UNSUPPORTED_MESSAGE')])
+
+    def _poll_response(self, request, result_id, result_part_number):
+        taxii = self.server.taxii
+        end = taxii.results[result_id]
+        packages = taxii.part(result_part_number)
+
+        yield self._message(
+            request, POLL_RESPONSE_HEADER,
+            more='true' if result_part_number < taxii.num_parts else 'false',
+            result_id=result_id,
+            result_part_number=result_part_number,
+            end=end,
+            record_count=len(taxii.packages)
+        )
+        for package in packages:
+            yield CONTENT_BLOCK.format(content=package, timestamp_label=end)
+        yield POLL_RESPONSE_FOOTER
+
+
+class TAXIIServer(object):
+    # minimal in-process TAXII 1.1 server: discovery, collection
+    # information, poll and Poll_Fulfillment. Every poll returns all
+    # the packages, split in parts of blocks_per_part content blocks
+    def __init__(self, packages, blocks_per_part=100, collection='bench', compress=True):
+        self.packages = packages
+        self.blocks_per_part = blocks_per_part
+        self.collection = collection
+        self.compress = compress
+
+        self.results = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def num_parts(self):
+        return max(1, (len(self.packages)+self.blocks_per_part-1)/self.blocks_per_part)
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    @property
+    def discovery_service(self):
+        return '{}/taxii-discovery-service'.format(self.base_url)
+
+    @property
+    def poll_service(self):
+        return '{}/taxii-poll-service'.format(self.base_url)
+
+    def part(self, result_part_number):
+        start = (result_part_number-1)*self.blocks_per_part
+        return self.packages[start:start+self.blocks_per_part]
+
+    def new_result(self, end):
+        result_id = str(uuid.uuid4())
+        self.results[result_id] = end
+        return result_id
+
+    def add_bytes_sent(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def start(self):
+        self._server = _HTTPServer(('127.0.0.1', 0), _TAXIIHandler)
+        self._server.taxii = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -30,8 +30,8 @@ setup(
         'Topic :: Security',
         'Topic :: Internet'
     ],
-    packages=find_packages(),
-    provides=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
+    provides=find_packages(exclude=['benchmarks']),
     install_requires=_requirements,
     package_data={
         '': [
@@ -0,0 +1,34 @@
+import collections
+
+
+class PackageCache(object):
+    # bounded set of STIX package fingerprints, the least recently
+    # seen fingerprints are evicted first
+    def __init__(self, size, fingerprints=None):
+        self.size = size
+        self._fingerprints = collections.OrderedDict()
+
+        if fingerprints is not None:
+            for f in fingerprints:
+                self.add(f)
+
+    def __contains__(self, fingerprint):
+        if fingerprint not in self._fingerprints:
+            return False
+
+        # move to the end, most recently seen
+        self._fingerprints[fingerprint] = self._fingerprints.pop(fingerprint)
+        return True
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def add(self, fingerprint):
+        self._fingerprints.pop(fingerprint, None)
+        self._fingerprints[fingerprint] = True
+
+        while len(self._fingerprints) > self.size:
+            self._fingerprints.popitem(last=False)
+
+    def fingerprints(self):
+        return self._fingerprints.keys()
@@ -0,0 +1,335 @@
+# Offline bulk ingest of saved TAXII 1.1 Poll_Responses and STIX
+# packages, indicators are written as NDJSON:
+#
+# python -m taxiing.ingest --prefix taxii responses.tar.gz > indicators.ndjson
+#
+# Inputs can be files, directories and tar or zip archives. Poll_Responses
+# are parsed and Content_Blocks are decoded exactly as the Miner does,
+# each line is {"indicator": ..., "value": {...}} with the attributes
+# the Miner would emit. Throughput is reported on stderr.
+
+import os
+import sys
+import json
+import time
+import tarfile
+import zipfile
+import logging
+import argparse
+import collections
+import multiprocessing
+
+from lxml import etree
+
+from .taxii import v11 as taxii11
+from .stix import decode as stix_decode
+from .stix import decode_element as stix_decode_element
+from .stix import attribute_name as stix_attribute_name
+
+LOG = logging.getLogger(__name__)
+
+# bytes read to detect the type of a message
+PEEK_SIZE = 16*1024
+
+
+class _PeekStream(object):
+    # file wrapper that replays the first bytes read and
+    # counts the bytes read from the underlying file
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.head = fileobj.read(PEEK_SIZE)
+        self.offset = 0
+        self.bytes = len(self.head)
+
+    def read(self, size=-1):
+        if self.offset < len(self.head):
+            if size < 0:
+                tail = self.fileobj.read()
+                result = self.head[self.offset:]+tail
+                self.offset = len(self.head)
+                self.bytes += len(tail)
+                return result
+
+            result = self.head[self.offset:self.offset+size]
+            self.offset += len(result)
+            return result
+
+        result = self.fileobj.read(size)
+        self.bytes += len(result)
+        return result
+
+
+def root_tag(head):
+    # tag of the root element of a message, None if head does not
+    # start with a well formed element
+    parser = etree.XMLPullParser(events=('start',), resolve_entities=False, huge_tree=True)
+    try:
+        parser.feed(head)
+        for _, element in parser.read_events():
+            return element.tag
+
+    except etree.XMLSyntaxError:
+        pass
+
+    return None
+
+
+def normalize(indicators, prefix=None):
+    # same attribute names and values of Miner._process_item
+    result = []
+    for item in indicators:
+        value = {}
+        for k, v in item.iteritems():
+            if k == 'indicator':
+                continue
+            value[stix_attribute_name(k, prefix)] = v
+
+        result.append(json.dumps({'indicator': item['indicator'], 'value': value}, sort_keys=True))
+
+    return result
+
+
+def _decode_lines(content, prefix):
+    # runs in the worker processes
+    _, indicators = stix_decode(content)
+    return normalize(indicators, prefix)
+
+
+def iter_sources(paths):
+    # (name, file object) of every regular file in paths, directories
+    # are walked and archives are expanded
+    for path in paths:
+        if path == '-':
+            for source in _iter_archive_stream('-', sys.stdin):
+                yield source
+            continue
+
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(filenames):
+                    for source in iter_sources([os.path.join(dirpath, fname)]):
+                        yield source
+            continue
+
+        if tarfile.is_tarfile(path):
+            with tarfile.open(path, 'r:*') as tf:
+                for member in tf:
+                    if not member.isfile():
+                        continue
+                    yield '{}:{}'.format(path, member.name), tf.extractfile(member)
+            continue
+
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    if info.filename.endswith('/'):
+                        continue
+                    with zf.open(info) as f:
+                        yield '{}:{}'.format(path, info.filename), f
+            continue
+
+        with open(path, 'rb') as f:
+            yield path, f
+
+
+def _iter_archive_stream(name, stream):
+    # stdin is either a tar stream or a single message
+    stream = _PeekStream(stream)
+    try:
+        tf = tarfile.open(fileobj=stream, mode='r|*')
+    except tarfile.TarError:
+        stream.offset = 0
+        yield name, stream
+        return
+
+    for member in tf:
+        if not member.isfile():
+            continue
+        yield '{}:{}'.format(name, member.name), tf.extractfile(member)
+
+
+class Ingest(object):
+    def __init__(self, output, prefix=None, processes=None, queue_depth=None):
+        self.output = output
+        self.prefix = prefix
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+
+        if queue_depth is None:
+            queue_depth = 4*processes
+        self.queue_depth = queue_depth
+
+        self.pool = None
+        self.pending = collections.deque()
+
+        self.statistics = collections.Counter()
+
+    def run(self, paths):
+        start = time.time()
+
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(processes=self.processes)
+
+        try:
+            for name, fileobj in iter_sources(paths):
+                self._ingest_source(name, fileobj)
+
+            self._pop_decoded()
+
+        finally:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+        self.statistics['elapsed'] = time.time()-start
+        return self.statistics
+
+    def _ingest_source(self, name, fileobj):
+        stream = fileobj if isinstance(fileobj, _PeekStream) else _PeekStream(fileobj)
+        tag = root_tag(stream.head)
+
+        self.statistics['files'] += 1
+        try:
+            if tag == taxii11.POLL_RESPONSE:
+                for _, element in taxii11.iterparse_poll_response(stream):
+                    if element.tag != taxii11.CONTENT_BLOCK:
+                        continue
+
+                    content, _ = taxii11.content_block_parts(element)
+                    if content is None:
+                        LOG.error('{} - Content_Block with no content'.format(name))
+                        continue
+
+                    self._ingest_package(content)
+
+            elif tag is not None and tag.rsplit('}', 1)[-1] == 'STIX_Package':
+                self._ingest_package(stream.read())
+
+            else:
+                LOG.error('{} - not a Poll_Response or a STIX_Package: {!r}'.format(name, tag))
+                self.statistics['skipped'] += 1
+
+        except etree.XMLSyntaxError:
+            LOG.exception('{} - error parsing file'.format(name))
+            self.statistics['errors'] += 1
+
+        self.statistics['bytes'] += stream.bytes
+
+    def _ingest_package(self, content):
+        # content is a STIX_Package element from a Poll_Response
+        # or the raw bytes of a STIX_Package
+        self.statistics['packages'] += 1
+
+        if self.pool is None:
+            if isinstance(content, str):
+                _, indicators = stix_decode(content)
+            else:
+                _, indicators = stix_decode_element(content)
+            self._write(normalize(indicators, self.prefix))
+            return
+
+        if not isinstance(content, str):
+            content = etree.tostring(content)
+        self.pending.append(self.pool.apply_async(_decode_lines, (content, self.prefix)))
+
+        self._pop_decoded(self.queue_depth)
+
+    def _pop_decoded(self, depth=0):
+        while len(self.pending) > depth:
+            self._write(self.pending.popleft().get())
+
+    def _write(self, lines):
+        for line in lines:
+            self.output.write(line)
+            self.output.write('\n')
+
+        self.statistics['indicators'] += len(lines)
+
+
+def _report(statistics):
+    statistics = dict(
+        (k, statistics[k]) for k in ['files', 'skipped', 'errors', 'packages', 'indicators', 'bytes', 'elapsed']
+    )
+    elapsed = max(statistics['elapsed'], 1e-6)
+    sys.stderr.write(
+        '{files} files ({skipped} skipped, {errors} errors), {packages} packages, '
+        '{indicators} indicators in {elapsed:.2f}s: '.format(**statistics)
+    )
+    sys.stderr.write(
+        '{:.1f} packages/s, {:.1f} indicators/s, {:.2f} MB/s\n'.format(
+            statistics['packages']/elapsed,
+            statistics['indicators']/elapsed,
+            statistics['bytes']/elapsed/(1024*1024)
+        )
+    )
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Decode saved TAXII 1.1 Poll_Responses and STIX packages to NDJSON'
+    )
+    parser.add_argument(
+        'paths',
+        nargs='+',
+        metavar='PATH',
+        help='file, directory, tar or zip archive, - for stdin'
+    )
+    parser.add_argument(
+        '--output', '-o',
+        default='-',
+        help='NDJSON output file, default stdout'
+    )
+    parser.add_argument(
+        '--prefix',
+        default=None,
+        help='prefix replacing stix in attribute names, as the Miner prefix option'
+    )
+    parser.add_argument(
+        '--processes', '-j',
+        type=int,
+        default=None,
+        help='decoding processes, default number of CPUs, 1 decodes in process'
+    )
+    parser.add_argument(
+        '--verbose', '-v',
+        action='store_true',
+        help='debug logging'
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+    output = sys.stdout
+    if args.output != '-':
+        output = open(args.output, 'wb')
+
+    try:
+        statistics = Ingest(
+            output=output,
+            prefix=args.prefix,
+            processes=args.processes
+        ).run(args.paths)
+
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    _report(statistics)
+
+    return 1 if statistics['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,23 @@
 import logging
 import os
+import sys
+import time
+import cProfile
+import shutil
+import socket
+import hashlib
+import tempfile
 import collections
+import multiprocessing
 from datetime import datetime, timedelta
 
+import gevent
+import gevent.queue
 import pytz
 import yaml
 import requests
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import ReadTimeoutError
 import bs4  # we use bs4 to parse the HTML page
 from lxml import etree
 
@@ -13,18 +25,116 @@ from minemeld.ft.basepoller import BasePollerFT
 from minemeld.ft.utils import interval_in_sec
 
 from .taxii import v11 as taxii11
+from .cache import PackageCache
 from .stix import decode as stix_decode
+from .stix import decode_element as stix_decode_element
+from .stix import ATTRIBUTES as STIX_ATTRIBUTES
+from .stix import attribute_name as stix_attribute_name
 
 LOG = logging.getLogger(__name__)
 
+# streams are read from the raw urllib3 response, timeouts while
+# parsing are not wrapped by requests
+TIMEOUT_ERRORS = (requests.Timeout, ReadTimeoutError, socket.timeout)
+
+# interval between checks of a pending decode result, AsyncResult.get()
+# blocks on a real lock and would stop every other greenlet of the engine
+DECODE_WAIT_MIN = 0.001
+DECODE_WAIT_MAX = 0.02
+
+
+def _new_progress(poll_service=None, begin=None, end=None, collection=None):
+    return {
+        'poll_service': poll_service,
+        'collection': collection,
+        'begin': begin,
+        'end': end,
+        'last_stix_package_ts': None,
+        'last_taxii_content_ts': None,
+        'completed_taxii_content_ts': None,
+        'ordered': True,
+        'result_id': None,
+        'result_part_number': None,
+        'content_blocks': 0,
+        'latency': 0.0,
+        'fingerprints': []
+    }
+
+
+def _new_collection_state(collection, poll_dt):
+    return {
+        'collection': collection,
+        'last_taxii_run': None,
+        'last_stix_package_ts': None,
+        'last_taxii_content_ts': None,
+        'poll_dt': poll_dt,
+        'timed_out_poll_dt': None,
+        'poll_checkpoint': None,
+        'count_only': False
+    }
+
+
+def _dt_to_ms(dt):
+    return int((dt - taxii11.EPOCH).total_seconds()*1000)
+
+
+def _ms_to_dt(ms):
+    return datetime.utcfromtimestamp(ms/1000).replace(tzinfo=pytz.UTC)
+
+
+def _timed_stix_decode(content, options):
+    # runs in the decode pool, the decoding time is sent back
+    # with the result to be accounted in the statistics
+    start = time.time()
+    return stix_decode(content, **options), time.time()-start
+
+
+class _MeteredStream(object):
+    # response body wrapper accounting the time spent
+    # waiting for data
+    def __init__(self, raw):
+        self.raw = raw
+        self.elapsed = 0.0
+
+    def read(self, *args):
+        start = time.time()
+        try:
+            return self.raw.read(*args)
+        finally:
+            self.elapsed += time.time()-start
+
+    def tell(self):
+        return self.raw.tell()
+
+
+class _WindowCompleted(object):
+    # yielded by the collection pollers after the indicators of a
+    # window, the state of the collection is updated by the consumer
+    # once those indicators have been processed
+    def __init__(self, state, progress):
+        self.state = state
+        self.progress = progress
+
+
+class _PrefetchedPart(object):
+    # Poll_Fulfillment response read in advance, the body is
+    # spooled to disk above prefetch_spool_size bytes
+    def __init__(self, spool, latency):
+        self.raw = spool
+        self.latency = latency
+
+    def close(self):
+        self.raw.close()
+
 
 class Miner(BasePollerFT):
     def __init__(self, name, chassis, config):
         self.discovered_poll_service = None
-        self.last_taxii_run = None
-        self.last_stix_package_ts = None
-        self.last_taxii_content_ts = None
+        self.collection_states = collections.OrderedDict()
         self.api_key = None
+        self._decode_pool = None
+        self._session = None
+        self.package_cache = None
 
         super(Miner, self).__init__(name, chassis, config)
 
@@ -47,16 +157,100 @@ class Miner(BasePollerFT):
             86400
         )
 
+        # adaptive poll window, between min_poll_dt and max_poll_dt
+        self.adaptive_poll_window = self.config.get('adaptive_poll_window', False)
+        self.min_poll_dt = min(self.config.get('min_poll_dt', 60), self.max_poll_dt)
+        self.adaptive_target_blocks = self.config.get('adaptive_target_blocks', 1000)
+        self.adaptive_target_time = self.config.get('adaptive_target_time', 60)
+
+        # plan the poll windows with COUNT_ONLY polls: empty ranges are
+        # skipped and ranges with more than planning_target_blocks
+        # records are split down to min_poll_dt
+        self.count_only_planning = self.config.get('count_only_planning', False)
+        self.planning_target_blocks = self.config.get('planning_target_blocks', self.adaptive_target_blocks)
+
+        # pipelined decoding of content blocks in worker processes, one
+        # CPU is left to the engine process reading the responses
+        self.decode_processes = self.config.get('decode_processes', 0)
+        if self.decode_processes > multiprocessing.cpu_count()-1:
+            self.decode_processes = max(0, multiprocessing.cpu_count()-1)
+            LOG.info('{} - decode_processes limited to {}'.format(self.name, self.decode_processes))
+        self.decode_queue_depth = self.config.get('decode_queue_depth', None)
+        if self.decode_queue_depth is None:
+            self.decode_queue_depth = 2*self.decode_processes
+
+        # HTTP connection pool
+        self.http_pool_size = self.config.get('http_pool_size', 10)
+        self.http_max_retries = self.config.get('http_max_retries', 0)
+        self.http_backoff_factor = self.config.get('http_backoff_factor', 0)
+
+        # ask for gzip/deflate compressed poll responses
+        self.compressed_transfer = self.config.get('compressed_transfer', False)
+
+        # number of STIX package fingerprints remembered across polls,
+        # packages already seen are not decoded again. 0 disables it
+        self.package_cache_size = self.config.get('package_cache_size', 0)
+        self.package_cache = None
+        if self.package_cache_size > 0:
+            self.package_cache = PackageCache(self.package_cache_size)
+
+        # merge repeated indicators inside each poll window, windows
+        # are not checkpointed when indicators are coalesced
+        self.coalesce_indicators = self.config.get('coalesce_indicators', False)
+        self.coalesce_max_indicators = self.config.get('coalesce_max_indicators', 10000)
+
+        # Poll_Fulfillment parts fetched in background while
+        # the current part is parsed
+        self.prefetch_parts = self.config.get('prefetch_parts', 0)
+        self.prefetch_spool_size = self.config.get('prefetch_spool_size', 16*1024*1024)
+
+        # asynchronous polls: the server can answer PENDING and the
+        # result is asked again after the wait interval it suggests
+        self.asynch_polling = self.config.get('asynch_polling', False)
+        self.asynch_default_wait = self.config.get('asynch_default_wait', 30)
+        self.asynch_max_wait = self.config.get('asynch_max_wait', 3600)
+
+        # number of poll windows polled at the same time. Windows after
+        # the first are buffered in memory, up to poll_window_buffer
+        # indicators each, then their responses are not read anymore
+        # until the previous windows have been emitted
+        self.poll_concurrency = self.config.get('poll_concurrency', 1)
+        self.poll_window_buffer = self.config.get('poll_window_buffer', 10000)
+
         # options for processing
         self.ip_version_auto_detect = self.config.get('ip_version_auto_detect', True)
         self.ignore_composition_operator = self.config.get('ignore_composition_operator', False)
         self.create_fake_indicator = self.config.get('create_fake_indicator', False)
+        self.decode_options = dict(
+            ip_version_auto_detect=self.ip_version_auto_detect,
+            ignore_composition_operator=self.ignore_composition_operator,
+            create_fake_indicator=self.create_fake_indicator
+        )
         self.lower_timestamp_precision = self.config.get('lower_timestamp_precision', False)
 
         self.discovery_service = self.config.get('discovery_service', None)
         self.poll_service = self.config.get('poll_service', None)
+        self.poll_service_ttl = interval_in_sec(self.config.get('poll_service_ttl', 3600))
+        if self.poll_service_ttl is None:
+            LOG.error(
+                '%s - wrong poll_service_ttl format: %s',
+                self.name, self.config.get('poll_service_ttl')
+            )
+            self.poll_service_ttl = 3600
         self.collection = self.config.get('collection', None)
 
+        # a node can poll multiple collections of the same server,
+        # indicators are then tagged with their collection
+        self.collections = self.config.get('collections', None)
+        self.tag_collection = self.collections is not None
+        if self.collections is None:
+            self.collections = [self.collection]
+        self.collection_concurrency = self.config.get('collection_concurrency', 1)
+
+        self.collection_states = collections.OrderedDict(
+            (c, _new_collection_state(c, self.max_poll_dt)) for c in self.collections
+        )
+
         self.side_config_path = os.path.join(
             os.environ['MM_CONFIG_DIR'],
             '%s_side_config.yml' % self.name
@@ -64,6 +258,25 @@ class Miner(BasePollerFT):
 
         self.prefix = self.config.get('prefix', None)
 
+        # attribute names as emitted, with the stix_ prefix replaced
+        self._attribute_names = {}
+        for attribute in ['type', 'taxii_collection'] + STIX_ATTRIBUTES:
+            self._attribute_name(attribute)
+
+        # the next poll is run under cProfile. profile_next_poll in
+        # the node config is a trigger, the value last consumed is kept
+        # in the saved state and a new poll is profiled only when the
+        # value changes (e.g. a timestamp). profile_next_poll in the side
+        # config is removed from the file once consumed
+        self.profile_next_poll = False
+        self.profile_trigger = self.config.get('profile_next_poll', None)
+        if self.profile_trigger:
+            self.profile_trigger = str(self.profile_trigger)
+        else:
+            self.profile_trigger = None
+        self.last_profile_trigger = None
+        self.profile_dir = self.config.get('profile_dir', os.environ['MM_CONFIG_DIR'])
+
         self.confidence_map = self.config.get('confidence_map', {
             'low': 40,
             'medium': 60,
@@ -79,6 +292,12 @@ class Miner(BasePollerFT):
         self._load_side_config()
 
     def _load_side_config(self):
+        # credentials and verify_cert are applied to the session,
+        # it will be rebuilt at the next request
+        if self._session is not None:
+            self._session.close()
+        self._session = None
+
         try:
             with open(self.side_config_path, 'r') as f:
                 sconfig = yaml.safe_load(f)
@@ -106,35 +325,146 @@ class Miner(BasePollerFT):
             self.verify_cert = verify_cert
             LOG.info('{} - Loaded verify cert from side config'.format(self.name))
 
+        if sconfig.pop('profile_next_poll', False):
+            self.profile_next_poll = True
+            LOG.info('{} - Next poll will be profiled'.format(self.name))
+
+            try:
+                with open(self.side_config_path, 'w') as f:
+                    yaml.safe_dump(sconfig, f, default_flow_style=False)
+
+            except Exception as e:
+                LOG.error('%s - Error updating side config: %s', self.name, str(e))
+
     def _saved_state_restore(self, saved_state):
         super(Miner, self)._saved_state_restore(saved_state)
-        self.last_taxii_run = saved_state.get('last_taxii_run', None)
-        LOG.info('last_taxii_run from sstate: %s', self.last_taxii_run)
+
+        self.last_profile_trigger = saved_state.get('last_profile_trigger', None)
+
+        self.discovered_poll_service = saved_state.get('discovered_poll_service', None)
+        if self.discovered_poll_service is not None and 'addresses' not in self.discovered_poll_service:
+            self.discovered_poll_service = None
+
+        sstates = saved_state.get('collections', None)
+        if sstates is None and len(self.collection_states) == 1:
+            # state saved by a single collection node
+            sstates = {
+                self.collections[0]: dict(
+                    (k, saved_state.get(k, None)) for k in ['last_taxii_run', 'poll_dt', 'poll_checkpoint']
+                )
+            }
+
+        for collection, state in self.collection_states.iteritems():
+            sstate = (sstates or {}).get(collection, None)
+            if sstate is None:
+                continue
+
+            state['last_taxii_run'] = sstate.get('last_taxii_run', None)
+            LOG.info('%s - last_taxii_run from sstate: %s', collection, state['last_taxii_run'])
+
+            poll_dt = sstate.get('poll_dt', None)
+            if self.adaptive_poll_window and poll_dt is not None:
+                state['poll_dt'] = min(self.max_poll_dt, max(self.min_poll_dt, poll_dt))
+                LOG.info('%s - poll_dt from sstate: %s', collection, state['poll_dt'])
+
+            checkpoint = sstate.get('poll_checkpoint', None)
+            if checkpoint is not None:
+                checkpoint['fingerprints'] = []
+                checkpoint.setdefault('collection', collection)
+                checkpoint.setdefault('latency', 0.0)
+            state['poll_checkpoint'] = checkpoint
+            LOG.info('%s - poll_checkpoint from sstate: %s', collection, checkpoint)
+
+        if self.package_cache_size > 0:
+            self.package_cache = PackageCache(
+                self.package_cache_size,
+                saved_state.get('package_cache', None)
+            )
 
     def _saved_state_create(self):
         sstate = super(Miner, self)._saved_state_create()
-        sstate['last_taxii_run'] = self.last_taxii_run
+        sstate['discovered_poll_service'] = self.discovered_poll_service
+        sstate['last_profile_trigger'] = self.last_profile_trigger
+
+        sstate['collections'] = {}
+        for collection, state in self.collection_states.iteritems():
+            checkpoint = state['poll_checkpoint']
+            if checkpoint is not None:
+                checkpoint = dict(
+                    (k, v) for k, v in checkpoint.iteritems() if k != 'fingerprints'
+                )
+
+            sstate['collections'][collection] = dict(
+                last_taxii_run=state['last_taxii_run'],
+                poll_dt=state['poll_dt'],
+                poll_checkpoint=checkpoint
+            )
+        if self.package_cache is not None:
+            sstate['package_cache'] = self.package_cache.fingerprints()
 
         return sstate
 
     def _saved_state_reset(self):
         super(Miner, self)._saved_state_reset()
-        self.last_taxii_run = None
+        for state in self.collection_states.itervalues():
+            state['last_taxii_run'] = None
+            state['poll_checkpoint'] = None
+        self.discovered_poll_service = None
+        if self.package_cache is not None:
+            self.package_cache = PackageCache(self.package_cache_size)
+
+    def _attribute_name(self, attribute):
+        name = stix_attribute_name(attribute, self.prefix)
+        self._attribute_names[attribute] = name
+        return name
 
     def _process_item(self, item):
-        indicator = item.pop('indicator')
+        self.statistics['indicators.{}'.format(item.get('type', 'unknown'))] += 1
+
+        # indicators are compact records until here
+        indicator = item['indicator']
+        attribute_names = self._attribute_names
         value = {}
         for k, v in item.iteritems():
-            if k.startswith('stix_') and self.prefix is not None:
-                k = self.prefix + k[4:]
-            value[k] = v
+            if k == 'indicator':
+                continue
+
+            name = attribute_names.get(k, None)
+            if name is None:
+                name = self._attribute_name(k)
+            value[name] = v
 
         return [[indicator, value]]
 
-    def _send_request(self, url, headers, data, stream=False):
+    def _build_session(self):
+        session = requests.Session()
+
         if self.api_key is not None and self.api_header is not None:
-            headers[self.api_header] = self.api_key
+            session.headers[self.api_header] = self.api_key
+
+        if self.username is not None and self.password is not None:
+            session.auth = (self.username, self.password)
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.http_pool_size,
+            pool_maxsize=self.http_pool_size,
+            max_retries=Retry(
+                total=self.http_max_retries,
+                backoff_factor=self.http_backoff_factor,
+                raise_on_status=False
+            )
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
 
+    def _send_request(self, url, headers, data, stream=False):
+        if self._session is None:
+            self._session = self._build_session()
+
+        # verify is passed with each request, on the session it would
+        # be overridden by REQUESTS_CA_BUNDLE and CURL_CA_BUNDLE
         rkwargs = dict(
             stream=stream,
             verify=self.verify_cert,
@@ -143,12 +473,9 @@ class Miner(BasePollerFT):
             data=data
         )
 
-        if self.username is not None and self.password is not None:
-            rkwargs['auth'] = (self.username, self.password)
-
         LOG.debug('{} - request to {!r}: {!r}'.format(self.name, url, rkwargs))
 
-        r = requests.post(
+        r = self._session.post(
             url,
             **rkwargs
         )
@@ -161,6 +488,14 @@ class Miner(BasePollerFT):
             )
             raise
 
+        self.statistics['http.requests'] += 1
+        self.statistics['http.ttfb_ms'] += r.elapsed.total_seconds()*1000
+
+        if stream:
+            # streams are read from r.raw, this makes urllib3 decompress
+            # them on the fly based on the Content-Encoding header
+            r.raw.decode_content = True
+
         return r
 
     def _raise_for_taxii_error(self, response):
@@ -174,7 +509,7 @@ class Miner(BasePollerFT):
             self.name, response.contents[0]['status_type']
         ))
 
-    def _discover_poll_service(self):
+    def _discover_poll_services(self, collections):
         # let's start from discovering the available services
         req = taxii11.discovery_request()
         LOG.debug('protocol {!r}'.format(self.discovery_service.split(':', 1)[0]))
@@ -244,10 +579,24 @@ class Miner(BasePollerFT):
         result = bs4.BeautifulSoup(result.text, 'xml')
         self._raise_for_taxii_error(result)
 
+        # one collection information response lists all the collections,
+        # a collection not found does not stop the discovery of the others
+        poll_services = {}
+        errors = {}
+        for collection in collections:
+            try:
+                poll_services[collection] = self._collection_poll_service(result, collection)
+
+            except RuntimeError as e:
+                errors[collection] = e
+
+        return poll_services, errors
+
+    def _collection_poll_service(self, result, collection):
         # from here we look for the collection
-        collections = result.find_all('Collection', collection_name=self.collection)
+        collections = result.find_all('Collection', collection_name=collection)
         if len(collections) == 0:
-            raise RuntimeError('{} - collection {} not found'.format(self.name, self.collection))
+            raise RuntimeError('{} - collection {} not found'.format(self.name, collection))
 
         # and the right poll service
         poll_service = None
@@ -267,7 +616,7 @@ class Miner(BasePollerFT):
                 poll_service = address
                 continue
 
-            msgbindings = coll_service.find_all('Message_Binding')
+            msgbindings = pservice.find_all('Message_Binding')
             if len(msgbindings) != 0:
                 for msgbinding in msgbindings:
                     if msgbinding.string == taxii11.MESSAGE_BINDING:
@@ -279,137 +628,895 @@ class Miner(BasePollerFT):
 
         return poll_service
 
-    def _poll_collection(self, poll_service, begin, end):
+    def _content_block_parts(self, element):
+        content, timestamp_label = taxii11.content_block_parts(element)
+        if content is None:
+            LOG.error('{} - Content_Block with no content'.format(self.name))
+
+        return content, timestamp_label
+
+    def _content_block_decoded(self, decoded, timestamp_label, fingerprint, progress):
+        progress['content_blocks'] += 1
+        self.statistics['poll.content_blocks'] += 1
+
+        if decoded is not None:
+            timestamp, indicators = decoded
+            for indicator in indicators:
+                if self.tag_collection:
+                    indicator.properties['taxii_collection'] = progress['collection']
+                yield indicator
+
+            if progress['last_stix_package_ts'] is None or timestamp > progress['last_stix_package_ts']:
+                LOG.debug('{} - last package ts: {!r}'.format(self.name, timestamp))
+                progress['last_stix_package_ts'] = timestamp
+
+        if fingerprint is not None:
+            progress['fingerprints'].append(fingerprint)
+
+        if timestamp_label is not None:
+            LOG.debug('{} - timestamp label: {!r}'.format(self.name, timestamp_label))
+            timestamp = taxii11.parse_timestamp_label(timestamp_label)
+            LOG.debug('{} - timestamp label: {!r}'.format(self.name, timestamp))
+
+            if progress['last_taxii_content_ts'] is None or timestamp > progress['last_taxii_content_ts']:
+                LOG.debug('{} - last content ts: {!r}'.format(self.name, timestamp))
+                # a later label, the blocks with the previous one are done
+                progress['completed_taxii_content_ts'] = progress['last_taxii_content_ts']
+                progress['last_taxii_content_ts'] = timestamp
+
+            elif timestamp < progress['last_taxii_content_ts']:
+                progress['ordered'] = False
+
+    def _process_content_block(self, element, pending, progress):
+        content, timestamp_label = self._content_block_parts(element)
+
+        serialized = None
+        fingerprint = None
+        if content is not None and self.package_cache is not None:
+            serialized = etree.tostring(content)
+            fingerprint = '{}:{}'.format(
+                content.get('id', None),
+                hashlib.sha1(serialized).hexdigest()
+            )
+            # the same package is emitted once per collection
+            if self.tag_collection:
+                fingerprint = '{}:{}'.format(progress['collection'], fingerprint)
+
+            if fingerprint in self.package_cache:
+                self.statistics['package_cache.hit'] += 1
+                content = None
+            else:
+                self.statistics['package_cache.miss'] += 1
+
+        if pending is None:
+            decoded = None
+            if content is not None:
+                start = time.time()
+                decoded = stix_decode_element(content, **self.decode_options)
+                self.statistics['decode.time_ms'] += (time.time()-start)*1000
+
+            return self._content_block_decoded(decoded, timestamp_label, fingerprint, progress)
+
+        # content is decoded by the pool while we keep reading
+        # from the stream, results are consumed in order
+        decoded = None
+        if content is not None:
+            if serialized is None:
+                serialized = etree.tostring(content)
+            decoded = self._decode_pool.apply_async(_timed_stix_decode, (serialized, self.decode_options))
+        pending.append((decoded, timestamp_label, fingerprint))
+
+        return self._pop_decoded(pending, progress, self.decode_queue_depth)
+
+    def _wait_decoded(self, decoded):
+        wait = DECODE_WAIT_MIN
+        while not decoded.ready():
+            gevent.sleep(wait)
+            wait = min(wait*2, DECODE_WAIT_MAX)
+
+        return decoded.get()
+
+    def _pop_decoded(self, pending, progress, depth=0):
+        while len(pending) > depth:
+            decoded, timestamp_label, fingerprint = pending.popleft()
+            if decoded is not None:
+                decoded, elapsed = self._wait_decoded(decoded)
+                self.statistics['decode.time_ms'] += elapsed*1000
+
+            for indicator in self._content_block_decoded(decoded, timestamp_label, fingerprint, progress):
+                yield indicator
+
+    def _poll_headers(self, poll_service):
+        return taxii11.headers(
+            protocol=poll_service.split(':', 1)[0],
+            accept_encoding='gzip, deflate' if self.compressed_transfer else 'identity'
+        )
+
+    def _poll_collection(self, poll_service, begin, end, progress):
         req = taxii11.poll_request(
-            collection_name=self.collection,
+            collection_name=progress['collection'],
             exclusive_begin_timestamp=begin,
-            inclusive_end_timestamp=end
+            inclusive_end_timestamp=end,
+            allow_asynch=self.asynch_polling
         )
         LOG.debug('{} - poll request: {}'.format(self.name, req))
-        reqhdrs = taxii11.headers(
-            protocol=poll_service.split(':', 1)[0]
+        result = self._send_request(
+            url=poll_service,
+            headers=self._poll_headers(poll_service),
+            data=req,
+            stream=True
+        )
+
+        for indicator in self._poll_parts(poll_service, result, progress):
+            yield indicator
+
+    def _count_records(self, poll_service, collection, begin, end):
+        req = taxii11.poll_request(
+            collection_name=collection,
+            exclusive_begin_timestamp=begin,
+            inclusive_end_timestamp=end,
+            response_type='COUNT_ONLY'
         )
         result = self._send_request(
             url=poll_service,
-            headers=reqhdrs,
+            headers=self._poll_headers(poll_service),
+            data=req
+        )
+        self.statistics['planning.count_requests'] += 1
+
+        return taxii11.parse_record_count(result.content)
+
+    def _next_poll_window(self, state, poll_service, ranges):
+        # ranges is a stack of time ranges still to be polled, earliest
+        # on top. Ranges are split in windows of at most poll_dt, with
+        # planning empty ranges are dropped and dense ranges are halved
+        while len(ranges) != 0:
+            begin, end = ranges.pop()
+            span = int((end-begin).total_seconds())
+
+            count = None
+            if state['count_only']:
+                count = self._count_records(poll_service, state['collection'], begin, end)
+                if count is None:
+                    LOG.info('{} - {} COUNT_ONLY polls not supported, planning disabled'.format(
+                        self.name, state['collection']
+                    ))
+                    state['count_only'] = False
+
+            if count is None:
+                if span > state['poll_dt']:
+                    middle = begin+timedelta(seconds=state['poll_dt'])
+                    ranges.append((middle, end))
+                    ranges.append((begin, middle))
+                    continue
+
+                return begin, end
+
+            count, partial = count
+            if count == 0 and not partial:
+                LOG.debug('{} - {} no records from {!r} to {!r}'.format(self.name, state['collection'], begin, end))
+                self.statistics['planning.skipped_ranges'] += 1
+                continue
+
+            dense = partial or count > self.planning_target_blocks
+            if span > state['poll_dt'] or (dense and span >= 2*self.min_poll_dt):
+                middle = begin+timedelta(seconds=span/2)
+                ranges.append((middle, end))
+                ranges.append((begin, middle))
+                continue
+
+            return begin, end
+
+        return None
+
+    def _poll_fulfillment(self, poll_service, collection, result_id, result_part_number):
+        req = taxii11.poll_fulfillment_request(
+            collection_name=collection,
+            result_id=result_id,
+            result_part_number=result_part_number
+        )
+        return self._send_request(
+            url=poll_service,
+            headers=self._poll_headers(poll_service),
             data=req,
             stream=True
         )
 
+    def _prefetch_part(self, poll_service, prefetch, result_part_number):
+        # runs in its own greenlet, errors are returned as (exc_info, None)
+        # and raised when the part is needed
+        try:
+            return None, self._fetch_part(poll_service, prefetch, result_part_number)
+
+        except Exception:
+            return sys.exc_info(), None
+
+    def _fetch_part(self, poll_service, prefetch, result_part_number):
+        result = self._poll_fulfillment(poll_service, prefetch['collection'], prefetch['result_id'], result_part_number)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=self.prefetch_spool_size)
+        stream = _MeteredStream(result.raw)
+        try:
+            shutil.copyfileobj(stream, spool, 64*1024)
+
+        except BaseException:
+            # failed or killed, the part is not returned
+            spool.close()
+            raise
+
+        finally:
+            self._account_transfer(stream)
+            result.close()
+        latency = result.elapsed.total_seconds()+stream.elapsed
+
+        spool.seek(0)
+        more = taxii11.poll_response_more(spool)
+        spool.seek(0)
+
+        if more:
+            prefetch['last_known'] = max(prefetch['last_known'], result_part_number+1)
+            self._schedule_prefetch(poll_service, prefetch)
+
+        return _PrefetchedPart(spool, latency)
+
+    def _schedule_prefetch(self, poll_service, prefetch):
+        # parts are fetched only when a previous part announced
+        # them, up to prefetch_parts parts after the current one
+        while True:
+            next_part = prefetch['scheduled']+1
+            if next_part > prefetch['last_known'] or next_part > prefetch['current']+self.prefetch_parts:
+                break
+
+            glet = gevent.spawn(self._prefetch_part, poll_service, prefetch, next_part)
+            prefetch['parts'].append((next_part, glet))
+            prefetch['scheduled'] = next_part
+
+    def _next_part(self, poll_service, collection, prefetch, result_id, result_part_number):
+        if prefetch is not None and len(prefetch['parts']) != 0:
+            part_number, glet = prefetch['parts'].popleft()
+            if part_number == result_part_number and prefetch['result_id'] == result_id:
+                error, part = glet.get()
+                if error is not None:
+                    raise error[0], error[1], error[2]
+
+                return part
+
+            LOG.error('{} - unexpected prefetched part {}, expected {}'.format(
+                self.name, part_number, result_part_number
+            ))
+            prefetch['parts'].appendleft((part_number, glet))
+            self._cancel_prefetch(prefetch)
+
+        return self._poll_fulfillment(poll_service, collection, result_id, result_part_number)
+
+    def _cancel_prefetch(self, prefetch):
+        gevent.killall([glet for _, glet in prefetch['parts']])
+        for _, glet in prefetch['parts']:
+            # killed greenlets return GreenletExit
+            if glet.successful() and isinstance(glet.value, tuple) and glet.value[1] is not None:
+                glet.value[1].close()
+        prefetch['parts'].clear()
+        prefetch['scheduled'] = prefetch['last_known'] = prefetch['current']
+
+    def _account_transfer(self, stream):
+        self.statistics['http.transfer_ms'] += stream.elapsed*1000
+        self.statistics['http.bytes'] += stream.tell()
+
+    def _iterparse(self, stream):
+        # time spent parsing the response, the time spent
+        # waiting for the network is accounted separately
+        events = taxii11.iterparse_poll_response(stream)
+        while True:
+            start = time.time()
+            waited = stream.elapsed
+            try:
+                event = next(events)
+            except StopIteration:
+                break
+            finally:
+                self.statistics['parse.time_ms'] += (time.time()-start-(stream.elapsed-waited))*1000
+
+            yield event
+
+    def _poll_parts(self, poll_service, result, progress, resumed=False):
+        pending = None
+        if self._decode_pool is not None:
+            pending = collections.deque()
+
+        prefetch = None
+        if self.prefetch_parts > 0:
+            prefetch = dict(
+                collection=progress['collection'],
+                result_id=None,
+                current=0,
+                scheduled=0,
+                last_known=0,
+                parts=collections.deque()
+            )
+
+        try:
+            for indicator in self._poll_parts_loop(poll_service, result, progress, pending, prefetch, resumed):
+                yield indicator
+
+        finally:
+            if prefetch is not None:
+                self._cancel_prefetch(prefetch)
+
+    def _asynch_result(self, poll_service, collection, status_detail, waited):
+        # the result set is being built by the server, it is asked
+        # again with a Poll_Fulfillment after the estimated wait
+        result_id = status_detail.get('RESULT_ID', None)
+        if result_id is None:
+            raise RuntimeError('{} - PENDING status with no RESULT_ID'.format(self.name))
+
+        if waited >= self.asynch_max_wait:
+            raise RuntimeError('{} - result {} still pending after {} seconds'.format(
+                self.name, result_id, waited
+            ))
+
+        try:
+            wait = int(status_detail.get('ESTIMATED_WAIT', self.asynch_default_wait))
+        except ValueError:
+            wait = self.asynch_default_wait
+        wait = max(1, min(wait, self.asynch_max_wait-waited))
+
+        LOG.info('{} - result {} pending, checking again in {} seconds'.format(self.name, result_id, wait))
+        self.statistics['asynch.pending'] += 1
+        gevent.sleep(wait)
+
+        return wait, self._poll_fulfillment(poll_service, collection, result_id, 1)
+
+    def _poll_parts_loop(self, poll_service, result, progress, pending, prefetch, resumed):
+        waited = 0
         while True:
             result_part_number = None
             result_id = None
             more = None
-            tag_stack = collections.deque()
+            status_detail = None
+            self.statistics['poll.parts'] += 1
+            stream = _MeteredStream(result.raw)
             try:
-                for action, element in etree.iterparse(result.raw, events=('start', 'end'), recover=True):
-                    if action == 'start':
-                        tag_stack.append(element.tag)
+                for _, element in self._iterparse(stream):
+                    if element.tag == taxii11.CONTENT_BLOCK:
+                        for indicator in self._process_content_block(element, pending, progress):
+                            yield indicator
 
-                    else:
-                        last_tag = tag_stack.pop()
-                        if last_tag != element.tag:
-                            raise RuntimeError('{} - error parsing poll response, mismatched tags'.format(self.name))
+                    elif element.tag == taxii11.STATUS_MESSAGE:
+                        # a resumed result set can just be expired, the
+                        # poll service is still valid
+                        if not resumed and element.get('status_type', None) in taxii11.STALE_SERVICE_STATUS_TYPES:
+                            self._invalidate_poll_service()
+
+                        if self.asynch_polling and element.get('status_type', None) == 'PENDING':
+                            status_detail = taxii11.parse_status_detail(element)
+                            break
 
-                    if action == 'end' and element.tag.endswith('Status_Message') and len(tag_stack) == 0:
                         self._raise_for_taxii_error(
                             bs4.BeautifulSoup(etree.tostring(element, encoding='unicode'), 'xml')
                         )
-                        return
+                        break
 
-                    elif action == 'end' and element.tag.endswith('Poll_Response') and len(tag_stack) == 0:
+                    elif element.tag == taxii11.POLL_RESPONSE:
                         result_id = element.get('result_id', None)
                         more = element.get('more', None)
                         result_part_number = element.get('result_part_number', None)
                         if result_part_number is not None:
                             result_part_number = int(result_part_number)
 
-                    elif action == 'end' and element.tag.endswith('Content_Block') and len(tag_stack) == 1:
-                        for c in element:
-                            if c.tag.endswith('Content'):
-                                if len(c) == 0:
-                                    LOG.error('{} - Content with no children'.format(self.name))
-                                    continue
+                        # next parts are fetched while this one is parsed
+                        if prefetch is not None and taxii11.parse_more(more) and \
+                           result_id is not None and result_part_number is not None:
+                            if prefetch['result_id'] != result_id:
+                                self._cancel_prefetch(prefetch)
+                                prefetch['result_id'] = result_id
+                                prefetch['scheduled'] = result_part_number
 
-                                content = etree.tostring(c[0], encoding='unicode')
+                            prefetch['current'] = result_part_number
+                            prefetch['scheduled'] = max(prefetch['scheduled'], result_part_number)
+                            prefetch['last_known'] = max(prefetch['last_known'], result_part_number+1)
+                            self._schedule_prefetch(poll_service, prefetch)
 
-                                timestamp, indicators = stix_decode(content)
-                                for indicator in indicators:
-                                    yield indicator
-
-                                if self.last_stix_package_ts is None or timestamp > self.last_stix_package_ts:
-                                    LOG.debug('{} - last package ts: {!r}'.format(self.name, timestamp))
-                                    self.last_stix_package_ts = timestamp
+            finally:
+                # prefetched parts have been accounted while spooled
+                if isinstance(result, _PrefetchedPart):
+                    progress['latency'] += result.latency
+                else:
+                    self._account_transfer(stream)
+                    progress['latency'] += result.elapsed.total_seconds()+stream.elapsed
+                result.close()
 
-                            elif c.tag.endswith('Timestamp_Label'):
-                                LOG.debug('{} - timestamp label: {!r}'.format(self.name, c.text))
-                                timestamp = taxii11.parse_timestamp_label(c.text)
-                                LOG.debug('{} - timestamp label: {!r}'.format(self.name, timestamp))
+            if status_detail is not None:
+                wait, result = self._asynch_result(poll_service, progress['collection'], status_detail, waited)
+                waited += wait
+                continue
 
-                                if self.last_taxii_content_ts is None or timestamp > self.last_taxii_content_ts:
-                                    LOG.debug('{} - last content ts: {!r}'.format(self.name, timestamp))
-                                    self.last_taxii_content_ts = timestamp
+            if pending is not None:
+                for indicator in self._pop_decoded(pending, progress):
+                    yield indicator
 
-                        element.clear()
-
-            finally:
-                result.close()
+            # all the content blocks of this part have been emitted,
+            # the result set can be resumed from the next part
+            progress['result_id'] = result_id
+            progress['result_part_number'] = result_part_number
 
             LOG.debug('{} - result_id: {} more: {}'.format(self.name, result_id, more))
 
-            if not more or more == '0' or more.lower() == 'false':
+            if not taxii11.parse_more(more):
                 break
 
             if result_id is None or result_part_number is None:
                 LOG.error('{} - More set to true but no result_id or result_part_number'.format(self.name))
                 break
 
-            req = taxii11.poll_fulfillment_request(
-                collection_name=self.collection,
-                result_id=result_id,
-                result_part_number=result_part_number+1
-            )
-            result = self._send_request(
-                url=poll_service,
-                headers=reqhdrs,
-                data=req,
-                stream=True
-            )
+            result = self._next_part(poll_service, progress['collection'], prefetch, result_id, result_part_number+1)
 
-    def _incremental_poll_collection(self, poll_service, begin, end):
-        cbegin = begin
-        dt = timedelta(seconds=self.max_poll_dt)
+    def _resume_poll_window(self, poll_service, checkpoint):
+        # the window was interrupted, try to continue the result set
+        # from the next part. If the server does not know the result
+        # set anymore the window is polled again
+        if checkpoint['result_id'] is not None:
+            LOG.info('{} - resuming result {} from part {}'.format(
+                self.name, checkpoint['result_id'], checkpoint['result_part_number']+1
+            ))
 
-        self.last_stix_package_ts = None
-        self.last_taxii_content_ts = None
+            emitted = False
+            try:
+                result = self._poll_fulfillment(
+                    checkpoint['poll_service'],
+                    checkpoint['collection'],
+                    checkpoint['result_id'],
+                    checkpoint['result_part_number']+1
+                )
+                for indicator in self._poll_parts(checkpoint['poll_service'], result, checkpoint, resumed=True):
+                    emitted = True
+                    yield indicator
+
+                return
+
+            except (requests.HTTPError, RuntimeError) as e:
+                if emitted:
+                    raise
+
+                LOG.info('{} - result {} can not be resumed: {}'.format(
+                    self.name, checkpoint['result_id'], str(e)
+                ))
+                checkpoint['result_id'] = None
+                checkpoint['result_part_number'] = None
+
+        # if content blocks arrived in timestamp label order, the window
+        # can be polled again after the last completed label. Blocks
+        # sharing the last label seen could still be missing
+        begin = checkpoint['begin']
+        completed = checkpoint.get('completed_taxii_content_ts', None)
+        if checkpoint['ordered'] and completed is not None:
+            begin = max(begin, completed)
+
+        checkpoint['poll_service'] = poll_service
+        for indicator in self._poll_window(poll_service, _ms_to_dt(begin), _ms_to_dt(checkpoint['end']), checkpoint):
+            yield indicator
+
+    def _poll_windows(self, state, begin, end):
+        cbegin = begin
+        dt = timedelta(seconds=state['poll_dt'])
 
         while cbegin < end:
             cend = min(end, cbegin+dt)
+            yield cbegin, cend
 
-            LOG.info('{} - polling {!r} to {!r}'.format(self.name, cbegin, cend))
-            result = self._poll_collection(
-                poll_service=poll_service,
-                begin=cbegin,
-                end=cend
-            )
+            cbegin = cend
+
+    def _adapt_poll_window(self, state, progress, window, latency):
+        # narrow the window after large or slow responses, widen it
+        # after small and fast ones
+        poll_dt = state['poll_dt']
+        if progress['content_blocks'] > self.adaptive_target_blocks or latency > self.adaptive_target_time:
+            poll_dt = poll_dt/2
+
+        elif window >= state['poll_dt'] and \
+                progress['content_blocks']*4 < self.adaptive_target_blocks and \
+                latency*4 < self.adaptive_target_time:
+            # windows truncated at the end of the poll are not used
+            # to widen the window, and the window is not widened back
+            # to a size that timed out during this run
+            if state['timed_out_poll_dt'] is None or poll_dt*2 < state['timed_out_poll_dt']:
+                poll_dt = poll_dt*2
+
+        poll_dt = min(self.max_poll_dt, max(self.min_poll_dt, poll_dt))
+        if poll_dt != state['poll_dt']:
+            LOG.info('{} - {} poll window {} -> {}'.format(self.name, state['collection'], state['poll_dt'], poll_dt))
+            state['poll_dt'] = poll_dt
+
+    def _bisect_poll_window(self, state, window):
+        if not self.adaptive_poll_window:
+            return False
+
+        poll_dt = window/2
+        if poll_dt < self.min_poll_dt:
+            return False
+
+        LOG.info('{} - poll window of {} timed out, retrying with {}'.format(self.name, window, poll_dt))
+        self.statistics['poll.bisected'] += 1
+        state['poll_dt'] = poll_dt
+        if state['timed_out_poll_dt'] is None or window < state['timed_out_poll_dt']:
+            state['timed_out_poll_dt'] = window
+
+        return True
+
+    def _poll_window(self, poll_service, begin, end, progress):
+        LOG.info('{} - polling {!r} to {!r}'.format(self.name, begin, end))
+        result = self._poll_collection(
+            poll_service=poll_service,
+            begin=begin,
+            end=end,
+            progress=progress
+        )
+
+        if self.coalesce_indicators:
+            result = self._coalesce(result)
+
+        return result
+
+    def _coalesce(self, iterator):
+        # indicators with the same indicator and type are merged before
+        # being emitted: attributes from later occurrences override the
+        # earlier ones, attributes only in earlier occurrences are kept.
+        # The buffer is flushed at the end of the window or when it
+        # holds coalesce_max_indicators indicators
+        buffer = collections.OrderedDict()
+
+        for i in iterator:
+            key = (i['indicator'], i['type'])
+
+            current = buffer.get(key, None)
+            if current is not None:
+                current.update(i)
+                self.statistics['coalesced'] += 1
+                continue
+
+            if len(buffer) >= self.coalesce_max_indicators:
+                for v in buffer.itervalues():
+                    yield v
+                buffer.clear()
+
+            buffer[key] = i
+
+        for v in buffer.itervalues():
+            yield v
+
+    def _window_completed(self, state, progress):
+        # windows are completed in order, the last run can be moved
+        # forward up to the last content block of this window
+        for k in ['last_stix_package_ts', 'last_taxii_content_ts']:
+            if progress[k] is None:
+                continue
+
+            if state[k] is None or progress[k] > state[k]:
+                state[k] = progress[k]
+
+        if state['last_taxii_content_ts'] is not None:
+            state['last_taxii_run'] = state['last_taxii_content_ts']
+
+        if state['poll_checkpoint'] is progress:
+            state['poll_checkpoint'] = None
+
+        self.statistics['poll.windows'] += 1
+
+        # packages are remembered only once their indicators
+        # have been emitted
+        if self.package_cache is not None:
+            for fingerprint in progress['fingerprints']:
+                self.package_cache.add(fingerprint)
+
+    def _concurrent_poll_windows(self, state, poll_service, begin, end):
+        # up to poll_concurrency windows are polled at the same time,
+        # each window is buffered in a bounded queue until all the
+        # previous windows have been emitted
+        windows = self._poll_windows(state, begin, end)
+        running = collections.deque()
 
-            for i in result:
+        try:
+            while True:
+                while len(running) < self.poll_concurrency:
+                    window = next(windows, None)
+                    if window is None:
+                        break
+
+                    progress = _new_progress(
+                        poll_service, _dt_to_ms(window[0]), _dt_to_ms(window[1]), state['collection']
+                    )
+                    queue = gevent.queue.Queue(maxsize=self.poll_window_buffer)
+                    glet = gevent.spawn(
+                        self._feed_queue,
+                        self._poll_window(poll_service, window[0], window[1], progress),
+                        queue
+                    )
+                    running.append((glet, queue, progress))
+
+                if len(running) == 0:
+                    break
+
+                glet, queue, progress = running[0]
+                while True:
+                    error, i = queue.get()
+                    if error is not None:
+                        raise error[0], error[1], error[2]
+
+                    if i is None:
+                        break
+
+                    yield i
+
+                running.popleft()
+                yield _WindowCompleted(state, progress)
+
+        finally:
+            gevent.killall([glet for glet, _, _ in running])
+
+    def _incremental_poll_collection(self, state, poll_service, begin, end, checkpoints=True):
+        state['last_stix_package_ts'] = None
+        state['last_taxii_content_ts'] = None
+        state['timed_out_poll_dt'] = None
+
+        # buffered windows are not checkpointed, the indicators of
+        # the parts already read could still be in the buffer
+        if self.poll_concurrency > 1 or self.coalesce_indicators:
+            checkpoints = False
+
+        if not checkpoints:
+            state['poll_checkpoint'] = None
+
+        if self.poll_concurrency > 1:
+            for i in self._concurrent_poll_windows(state, poll_service, begin, end):
                 yield i
 
-            if self.last_taxii_content_ts is not None:
-                self.last_taxii_run = self.last_taxii_content_ts
+            return
 
-            cbegin = cend
+        checkpoint = state['poll_checkpoint']
+        if checkpoint is not None and checkpoint['end'] <= _dt_to_ms(end):
+            for i in self._resume_poll_window(poll_service, checkpoint):
+                yield i
 
-    def _build_iterator(self, now):
+            yield _WindowCompleted(state, checkpoint)
+            begin = max(begin, _ms_to_dt(checkpoint['end']))
+
+        state['count_only'] = self.count_only_planning
+        ranges = []
+        if begin < end:
+            ranges.append((begin, end))
+
+        while True:
+            window = self._next_poll_window(state, poll_service, ranges)
+            if window is None:
+                break
+
+            cbegin, cend = window
+            window = int((cend-cbegin).total_seconds())
+
+            progress = _new_progress(poll_service, _dt_to_ms(cbegin), _dt_to_ms(cend), state['collection'])
+            if checkpoints:
+                state['poll_checkpoint'] = progress
+            try:
+                for i in self._poll_window(poll_service, cbegin, cend, progress):
+                    yield i
+
+            except TIMEOUT_ERRORS:
+                # retry the first half of the window
+                if not self._bisect_poll_window(state, window):
+                    raise
+                ranges.append((cbegin, cend))
+                continue
+
+            yield _WindowCompleted(state, progress)
+            # the window is adapted on the time spent waiting for the
+            # server, not on the time spent processing the indicators
+            if self.adaptive_poll_window:
+                self._adapt_poll_window(state, progress, window, progress['latency'])
+
+    def _sequential_poll_collections(self, pollers):
+        # a failing collection does not stop the others, the first
+        # error is raised at the end
+        exc_info = None
+        for poller in pollers:
+            try:
+                for i in poller:
+                    yield i
+
+            except Exception:
+                LOG.exception('{} - error polling collection'.format(self.name))
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _feed_queue(self, iterator, queue):
+        # items are followed by (None, None) at the end of the iterator,
+        # errors are sent as (exc_info, None)
+        try:
+            for i in iterator:
+                queue.put((None, i))
+
+        except Exception:
+            queue.put((sys.exc_info(), None))
+            return
+
+        queue.put((None, None))
+
+    def _concurrent_poll_collections(self, pollers):
+        # up to collection_concurrency collections are polled at the same
+        # time, results are merged through a bounded queue. Window
+        # completions travel in the queue after the window indicators
+        queue = gevent.queue.Queue(maxsize=1024)
+        pending = collections.deque(pollers)
+        glets = []
+        running = 0
+        exc_info = None
+
+        try:
+            while running != 0 or len(pending) != 0:
+                while len(pending) != 0 and running < self.collection_concurrency:
+                    glets.append(gevent.spawn(self._feed_queue, pending.popleft(), queue))
+                    running += 1
+
+                error, i = queue.get()
+                if i is not None:
+                    yield i
+                    continue
+
+                # a poller is done
+                running -= 1
+                if error is not None:
+                    LOG.error('{} - error polling collection'.format(self.name), exc_info=error)
+                    if exc_info is None:
+                        exc_info = error
+
+        finally:
+            gevent.killall(glets)
+
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _run_poll(self, iterator):
+        # the decode pool is started at the first poll and kept
+        # for the life of the node
+        if self.decode_processes > 0 and self._decode_pool is None:
+            self._decode_pool = multiprocessing.Pool(processes=self.decode_processes)
+
+        for i in iterator:
+            if isinstance(i, _WindowCompleted):
+                self._window_completed(i.state, i.progress)
+                continue
+
+            yield i
+
+    def _terminate_decode_pool(self):
+        if self._decode_pool is None:
+            return
+
+        self._decode_pool.terminate()
+        self._decode_pool.join()
+        self._decode_pool = None
+
+    def _get_poll_services(self, now):
+        # poll services and discovery errors by collection
         if self.poll_service is not None:
-            discovered_poll_service = self.poll_service
-        else:
-            discovered_poll_service = self._discover_poll_service()
+            return dict((c, self.poll_service) for c in self.collections), {}
+
+        cached = self.discovered_poll_service
+        if cached is not None and \
+           cached['discovery_service'] == self.discovery_service and \
+           all(c in cached['addresses'] for c in self.collections) and \
+           now - cached['timestamp'] < self.poll_service_ttl*1000:
+            return cached['addresses'], {}
+
+        start = time.time()
+        try:
+            addresses, errors = self._discover_poll_services(self.collections)
+        finally:
+            self.statistics['discovery.count'] += 1
+            self.statistics['discovery.time_ms'] += (time.time()-start)*1000
+        self.discovered_poll_service = dict(
+            addresses=addresses,
+            discovery_service=self.discovery_service,
+            timestamp=now
+        )
+
+        return addresses, errors
+
+    def _invalidate_poll_service(self):
+        if self.discovered_poll_service is None:
+            return
+
+        LOG.info('{} - poll services {!r} invalidated'.format(
+            self.name, self.discovered_poll_service['addresses']
+        ))
+        self.discovered_poll_service = None
 
-        LOG.debug('{} - poll service: {!r}'.format(self.name, discovered_poll_service))
+    def _discovery_failed(self, error):
+        # poller of a collection with no poll service, the discovery
+        # error is raised in place of polling the collection
+        raise error
+        yield
 
-        last_run = self.last_taxii_run
+    def _check_poll_service(self, iterator):
+        # errors pointing to a stale poll service trigger a new
+        # discovery at the next poll
+        try:
+            for i in iterator:
+                yield i
+
+        except requests.ConnectionError:
+            self._invalidate_poll_service()
+            raise
+
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in [404, 405, 410]:
+                self._invalidate_poll_service()
+            raise
+
+    def _profiled_iterator(self, now):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            for i in self._poll_iterator(now):
+                yield i
+
+        finally:
+            profiler.disable()
+
+            path = os.path.join(self.profile_dir, '{}-{}.prof'.format(
+                self.name, time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+            ))
+            try:
+                profiler.dump_stats(path)
+                LOG.info('{} - poll profile saved to {}'.format(self.name, path))
+            except Exception as e:
+                LOG.error('{} - error saving poll profile: {}'.format(self.name, str(e)))
+
+    def _build_iterator(self, now):
+        if self.profile_trigger is not None and self.profile_trigger != self.last_profile_trigger:
+            self.profile_next_poll = True
+
+        if self.profile_next_poll:
+            self.profile_next_poll = False
+            self.last_profile_trigger = self.profile_trigger
+            return self._profiled_iterator(now)
+
+        return self._poll_iterator(now)
+
+    def _poll_iterator(self, now):
+        poll_services, errors = self._get_poll_services(now)
+
+        LOG.debug('{} - poll services: {!r}'.format(self.name, poll_services))
+
+        # collections polled concurrently are not checkpointed
+        concurrent = len(self.collection_states) > 1 and self.collection_concurrency > 1
+
+        pollers = []
+        for collection, state in self.collection_states.iteritems():
+            if collection in errors:
+                pollers.append(self._discovery_failed(errors[collection]))
+                continue
+
+            begin, end = self._poll_interval(state, now)
+            pollers.append(self._check_poll_service(self._incremental_poll_collection(
+                state,
+                poll_services[collection],
+                begin=begin,
+                end=end,
+                checkpoints=not concurrent
+            )))
+
+        if len(pollers) == 1:
+            return self._run_poll(pollers[0])
+
+        if concurrent:
+            return self._run_poll(self._concurrent_poll_collections(pollers))
+
+        return self._run_poll(self._sequential_poll_collections(pollers))
+
+    def _poll_interval(self, state, now):
+        last_run = state['last_taxii_run']
         if last_run is None:
             last_run = now-(self.initial_interval*1000)
 
@@ -423,16 +1530,21 @@ class Miner(BasePollerFT):
             end = end.replace(second=0, microsecond=0)
             begin = begin.replace(second=0, microsecond=0)
 
-        return self._incremental_poll_collection(
-            discovered_poll_service,
-            begin=begin,
-            end=end
-        )
+        return begin, end
 
     def _flush(self):
-        self.last_taxii_run = None
+        for state in self.collection_states.itervalues():
+            state['last_taxii_run'] = None
+            state['poll_checkpoint'] = None
+        # the packages polled again after a flush must be emitted
+        if self.package_cache is not None:
+            self.package_cache = PackageCache(self.package_cache_size)
         super(Miner, self)._flush()
 
+    def stop(self):
+        super(Miner, self).stop()
+        self._terminate_decode_pool()
+
     def hup(self, source=None):
         LOG.info('%s - hup received, reload side config', self.name)
         self._load_side_config()
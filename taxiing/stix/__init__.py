@@ -1,21 +1,60 @@
 import logging
-import datetime
 
-import pytz
-import dateutil.parser
-from bs4 import BeautifulSoup
+from lxml import etree
 
 from .package import extract as package_extract_properties
 from .observable import extract as observable_extract_properties
+from .indicator import Indicator
 
 from . import domainnameobject
 from . import fileobject
 from . import uriobject
 from . import addressobject
+from .utils import XSI_TYPE, localname
+from ..timestamp import parse_timestamp
 
 
 LOG = logging.getLogger(__name__)
-EPOCH = datetime.datetime.utcfromtimestamp(0).replace(tzinfo=pytz.UTC)
+
+PARSER = etree.XMLParser(
+    recover=True,
+    resolve_entities=False,
+    huge_tree=True
+)
+
+# ElementPath expressions, {*} matches any namespace
+OBSERVABLES = './/{*}Observable'
+OBJECT = '{*}Object'
+PROPERTIES = '{*}Properties'
+RELATED_OBJECTS = '{*}Related_Objects/{*}Related_Object/{*}Properties'
+
+
+# attributes set by the decoders besides indicator and type
+ATTRIBUTES = [
+    'share_level',
+    'stix_title',
+    'stix_description',
+    'stix_package_title',
+    'stix_package_description',
+    'stix_package_short_description',
+    'stix_package_information_source',
+    'stix_file_name',
+    'stix_file_size',
+    'stix_file_format'
+] + fileobject.HASH_ATTRIBUTES.values()
+
+
+# name of an attribute as emitted by the Miner, stix_ is replaced
+# by prefix if set
+def attribute_name(attribute, prefix):
+    if prefix is None or not attribute.startswith('stix_'):
+        return attribute
+
+    name = prefix + attribute[4:]
+    if isinstance(name, str):
+        name = intern(name)
+
+    return name
 
 
 DECODERS = {
@@ -28,22 +67,21 @@ DECODERS = {
 
 
 def object_extract_properties(props, kwargs):
-    type_ = props.get('xsi:type').rsplit(':')[-1]
+    type_ = props.get(XSI_TYPE, None)
+    if type_ is None:
+        LOG.error('cybox Object with no xsi:type')
+        return []
+    type_ = type_.rsplit(':')[-1]
 
     if type_ not in DECODERS:
-        LOG.error('Unhandled cybox Object type: {!r} - {!r}'.format(type_, props))
+        LOG.error('Unhandled cybox Object type: {!r} - {!r}'.format(type_, dict(props.attrib)))
         return []
 
     return DECODERS[type_](props, **kwargs)
 
 
 def _parse_stix_timestamp(stix_timestamp):
-    dt = dateutil.parser.parse(stix_timestamp)
-
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=pytz.UTC)
-    delta = dt - EPOCH
-    return int(delta.total_seconds()*1000)
+    return parse_timestamp(stix_timestamp)
 
 
 def _deduplicate(indicators):
@@ -55,16 +93,43 @@ def _deduplicate(indicators):
     return result.values()
 
 
-def decode(content, **kwargs):
-    result = []
+def _parse(content):
+    if isinstance(content, unicode):
+        # lxml refuses unicode strings with an encoding declaration
+        content = content.encode('utf-8')
+        parser = etree.XMLParser(
+            recover=True,
+            resolve_entities=False,
+            huge_tree=True,
+            encoding='utf-8'
+        )
+        return etree.fromstring(content, parser=parser)
+
+    return etree.fromstring(content, parser=PARSER)
+
 
-    package = BeautifulSoup(content, 'xml')
+def decode(content, **kwargs):
+    try:
+        package = _parse(content)
+    except etree.XMLSyntaxError:
+        LOG.exception('Error parsing STIX package')
+        return None, []
 
-    if package.contents[0].name != 'STIX_Package':
+    if package is None:
         LOG.error('No STIX package in content')
         return None, []
 
-    package = package.contents[0]
+    return decode_element(package, **kwargs)
+
+
+# package is an already parsed STIX_Package element, it is only read
+# so it can be an element from an etree.iterparse stream
+def decode_element(package, **kwargs):
+    result = []
+
+    if localname(package) != 'STIX_Package':
+        LOG.error('No STIX package in content')
+        return None, []
 
     timestamp = package.get('timestamp', None)
     if timestamp is not None:
@@ -72,37 +137,22 @@ def decode(content, **kwargs):
 
     pprops = package_extract_properties(package)
 
-    observables = package.find_all('Observable')
-    for o in observables:
-        gprops = observable_extract_properties(o)
-
-        obj = next((ob for ob in o if ob.name == 'Object'), None)
+    for o in package.iterfind(OBSERVABLES):
+        obj = o.find(OBJECT)
         if obj is None:
             continue
 
+        gprops = observable_extract_properties(o)
+
         # main properties
-        properties = next((c for c in obj if c.name == 'Properties'), None)
+        properties = obj.find(PROPERTIES)
         if properties is not None:
             for r in object_extract_properties(properties, kwargs):
-                r.update(gprops)
-                r.update(pprops)
-
-                result.append(r)
+                result.append(Indicator(r, gprops, pprops))
 
         # then related objects
-        related = next((c for c in obj if c.name == 'Related_Objects'), None)
-        if related is not None:
-            for robj in related:
-                if robj.name != 'Related_Object':
-                    continue
-
-                properties = next((c for c in robj if c.name == 'Properties'), None)
-                if properties is None:
-                    continue
-
-                for r in object_extract_properties(properties, kwargs):
-                    r.update(gprops)
-                    r.update(pprops)
-                    result.append(r)
+        for properties in obj.iterfind(RELATED_OBJECTS):
+            for r in object_extract_properties(properties, kwargs):
+                result.append(Indicator(r, gprops, pprops))
 
     return timestamp, _deduplicate(result)
@@ -1,29 +1,55 @@
+import re
+import socket
 import logging
 
 from netaddr import IPAddress
 
 LOG = logging.getLogger(__name__)
 
+ADDRESS_VALUE = './/{*}Address_Value'
+
+# canonical dotted quads, other forms accepted by netaddr (octal and
+# hex octets, less than 4 parts, trailing spaces, ...) go through it
+_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+IPV4 = re.compile(r'^{0}\.{0}\.{0}\.{0}$'.format(_OCTET))
+
+
+def ip_version(value):
+    if IPV4.match(value) is not None:
+        return 4
+
+    if ':' in value:
+        try:
+            socket.inet_pton(socket.AF_INET6, value)
+            return 6
+        except (socket.error, ValueError):
+            pass
+
+    try:
+        return IPAddress(value).version
+    except Exception:
+        return None
+
 
 def decode(props, ip_version_auto_detect=False, **kwargs):
-    indicator = props.find('Address_Value')
-    if indicator is None:
+    indicator = props.find(ADDRESS_VALUE)
+    if indicator is None or indicator.text is None:
         return []
-    indicator = indicator.string.encode('ascii', 'replace')
+    indicator = indicator.text.encode('ascii', 'replace')
 
+    # the version of IP addresses is detected from the value,
+    # e-mail addresses keep their category
     acategory = props.get('category', None)
-    if acategory is None or ip_version_auto_detect:
-        try:
-            ip = IPAddress(indicator)
-            if ip.version == 4:
-                type_ = 'IPv4'
-            elif ip.version == 6:
-                type_ = 'IPv6'
-            else:
-                LOG.error('Unknown ip version: {!r}'.format(ip.version))
-                return []
-
-        except Exception:
+    if acategory is None or (ip_version_auto_detect and acategory != 'e-mail'):
+        version = ip_version(indicator)
+        if version == 4:
+            type_ = 'IPv4'
+        elif version == 6:
+            type_ = 'IPv6'
+        elif version is None:
+            return []
+        else:
+            LOG.error('Unknown ip version: {!r}'.format(version))
             return []
 
     elif acategory == 'ipv4-addr':
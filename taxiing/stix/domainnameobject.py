@@ -1,13 +1,16 @@
+VALUE = './/{*}Value'
+
+
 def decode(props, **kwargs):
     dtype = props.get('type', 'FQDN')
     if dtype != 'FQDN':
         return []
 
-    domain = props.find('Value')
-    if domain is None:
+    domain = props.find(VALUE)
+    if domain is None or domain.text is None:
         return []
 
     return [{
-        'indicator': domain.string.encode('ascii', 'replace'),
+        'indicator': domain.text.encode('ascii', 'replace'),
         'type': 'domain'
     }]
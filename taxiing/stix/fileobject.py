@@ -1,17 +1,28 @@
+from .utils import child_text
+
+HASHES = './/{*}Hash'
+HASH_TYPE = './/{*}Type'
+HASH_VALUE = './/{*}Simple_Hash_Value'
+
+# hash types and attribute names are shared by all the indicators
+HASH_TYPES = dict((t, t) for t in ['md5', 'sha1', 'sha256', 'ssdeep'])
+HASH_ATTRIBUTES = dict((t, intern('stix_file_{}'.format(t))) for t in HASH_TYPES)
+
+
 def _decode_basic_props(props):
     result = {}
 
-    name = next((c for c in props if c.name == 'File_Name'), None)
+    name = child_text(props, 'File_Name')
     if name is not None:
-        result['stix_file_name'] = name.text
+        result['stix_file_name'] = name
 
-    size = next((c for c in props if c.name == 'File_Size'), None)
+    size = child_text(props, 'File_Size')
     if size is not None:
-        result['stix_file_size'] = size.text
+        result['stix_file_size'] = size
 
-    format = next((c for c in props if c.name == 'File_Format'), None)
+    format = child_text(props, 'File_Format')
     if format is not None:
-        result['stix_file_format'] = format.text
+        result['stix_file_format'] = format
 
     return result
 
@@ -21,19 +32,18 @@ def decode(props, **kwargs):
 
     bprops = _decode_basic_props(props)
 
-    hashes = props.find_all('Hash')
-    for h in hashes:
-        htype = h.find('Type')
-        if htype is None:
+    for h in props.iterfind(HASHES):
+        htype = h.find(HASH_TYPE)
+        if htype is None or htype.text is None:
             continue
-        htype = htype.string.lower()
-        if htype not in ['md5', 'sha1', 'sha256', 'ssdeep']:
+        htype = HASH_TYPES.get(htype.text.lower(), None)
+        if htype is None:
             continue
 
-        value = h.find('Simple_Hash_Value')
-        if value is None:
+        value = h.find(HASH_VALUE)
+        if value is None or value.text is None:
             continue
-        value = value.string.lower()
+        value = value.text.lower()
 
         result.append({
             'indicator': value,
@@ -45,7 +55,7 @@ def decode(props, **kwargs):
             if r['type'] == r2['type']:
                 continue
 
-            r['stix_file_{}'.format(r2['type'])] = r2['indicator']
+            r[HASH_ATTRIBUTES[r2['type']]] = r2['indicator']
 
         r.update(bprops)
 
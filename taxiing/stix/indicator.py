@@ -0,0 +1,54 @@
+# properties shared by all the indicators of an observable or of a
+# package are referenced, not copied. Precedence is the same of the
+# old dict layout: package over observable over object properties
+EMPTY = {}
+
+
+class Indicator(object):
+    __slots__ = ('properties', 'observable', 'package')
+
+    def __init__(self, properties, observable=EMPTY, package=EMPTY):
+        self.properties = properties
+        self.observable = observable
+        self.package = package
+
+    def __getstate__(self):
+        return (self.properties, self.observable, self.package)
+
+    def __setstate__(self, state):
+        self.properties, self.observable, self.package = state
+
+    def __getitem__(self, key):
+        for p in (self.package, self.observable, self.properties):
+            if key in p:
+                return p[key]
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.package or key in self.observable or key in self.properties
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def iteritems(self):
+        # keys overridden by a later property set are yielded
+        # more than once, the last value wins
+        for p in (self.properties, self.observable, self.package):
+            for item in p.iteritems():
+                yield item
+
+    def as_dict(self):
+        return dict(self.iteritems())
+
+    def update(self, other):
+        # used when merging occurrences of the same indicator,
+        # the shared property sets are left untouched
+        merged = self.as_dict()
+        merged.update(other.iteritems())
+        self.properties = merged
+        self.observable = EMPTY
+        self.package = EMPTY
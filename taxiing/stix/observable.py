@@ -1,14 +1,15 @@
+from .utils import child_text
+
+
 def extract(observable):
     result = {}
 
-    title = next((c for c in observable if c.name == 'Title'), None)
+    title = child_text(observable, 'Title')
     if title is not None:
-        title = title.text
         result['stix_title'] = title
 
-    description = next((c for c in observable if c.name == 'Description'), None)
+    description = child_text(observable, 'Description')
     if description is not None:
-        description = description.text
         result['stix_description'] = description
 
     return result
@@ -1,50 +1,52 @@
+from .utils import XSI_TYPE, text, child_text
+
+HEADER = './/{*}STIX_Header'
+MARKING_STRUCTURES = './/{*}Marking_Structure'
+INFORMATION_SOURCE_NAME = '{*}Information_Source/{*}Identity/{*}Name'
+
+
 def extract(package):
     result = {}
 
-    header = package.find_all('STIX_Header')
-    if len(header) == 0:
+    header = package.find(HEADER)
+    if header is None:
         return result
 
     # share level
-    mstructures = header[0].find_all('Marking_Structure')
-    for ms in mstructures:
-        type_ = ms.get('xsi:type')
-        if type_ is result:
+    for ms in header.iterfind(MARKING_STRUCTURES):
+        type_ = ms.get(XSI_TYPE, None)
+        if type_ is None:
             continue
 
-        color = ms.get('color')
-        if color is result:
+        color = ms.get('color', None)
+        if color is None:
             continue
 
         type_ = type_.lower()
         if 'tlpmarkingstructuretype' not in type_:
             continue
 
-        result['share_level'] = color.lower()
+        result['share_level'] = intern(color.lower())
         break
 
     # decode title
-    title = next((c for c in header[0] if c.name == 'Title'), None)
+    title = child_text(header, 'Title')
     if title is not None:
-        result['stix_package_title'] = title.text
+        result['stix_package_title'] = title
 
     # decode description
-    description = next((c for c in header[0] if c.name == 'Description'), None)
+    description = child_text(header, 'Description')
     if description is not None:
-        result['stix_package_description'] = description.text
+        result['stix_package_description'] = description
 
     # decode description
-    sdescription = next((c for c in header[0] if c.name == 'Short_Description'), None)
+    sdescription = child_text(header, 'Short_Description')
     if sdescription is not None:
-        result['stix_package_short_description'] = sdescription.text
+        result['stix_package_short_description'] = sdescription
 
     # decode identity name from information_source
-    information_source = next((c for c in header[0] if c.name == 'Information_Source'), None)
-    if information_source is not None:
-        identity = next((c for c in information_source if c.name == 'Identity'), None)
-        if identity is not None:
-            name = next((c for c in identity if c.name == 'Name'))
-            if name is not None:
-                result['stix_package_information_source'] = name.text
+    name = header.find(INFORMATION_SOURCE_NAME)
+    if name is not None:
+        result['stix_package_information_source'] = text(name)
 
     return result
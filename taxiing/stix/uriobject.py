@@ -1,3 +1,6 @@
+VALUE = './/{*}Value'
+
+
 def decode(props, **kwargs):
     utype = props.get('type', 'URL')
     if utype == 'URL':
@@ -7,11 +10,11 @@ def decode(props, **kwargs):
     else:
         return []
 
-    url = props.find('Value')
-    if url is None:
+    url = props.find(VALUE)
+    if url is None or url.text is None:
         return []
 
     return [{
-        'indicator': url.string.encode('ascii', 'replace'),
+        'indicator': url.text.encode('ascii', 'replace'),
         'type': type_
     }]
@@ -0,0 +1,22 @@
+from lxml import etree
+
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+
+# XPath string() returns the concatenated text of all the descendants
+text = etree.XPath('string()', smart_strings=False)
+
+
+def localname(element):
+    tag = element.tag
+    if not isinstance(tag, basestring):
+        return None
+
+    return tag.rsplit('}', 1)[-1]
+
+
+def child_text(element, name):
+    c = element.find('{*}'+name)
+    if c is None:
+        return None
+
+    return text(c)
@@ -1,9 +1,28 @@
 import uuid
 import datetime
 
-import dateutil
 import pytz
+from lxml import etree
 
+from ..timestamp import parse_timestamp
+
+
+NAMESPACE = 'http://taxii.mitre.org/messages/taxii_xml_binding-1.1'
+
+POLL_RESPONSE = '{{{}}}Poll_Response'.format(NAMESPACE)
+STATUS_MESSAGE = '{{{}}}Status_Message'.format(NAMESPACE)
+CONTENT_BLOCK = '{{{}}}Content_Block'.format(NAMESPACE)
+CONTENT = '{{{}}}Content'.format(NAMESPACE)
+TIMESTAMP_LABEL = '{{{}}}Timestamp_Label'.format(NAMESPACE)
+RECORD_COUNT = '{{{}}}Record_Count'.format(NAMESPACE)
+STATUS_DETAIL_ENTRY = '{{{0}}}Status_Detail/{{{0}}}Detail'.format(NAMESPACE)
+
+# status types pointing to a poll service that is no longer valid
+STALE_SERVICE_STATUS_TYPES = [
+    'DESTINATION_COLLECTION_ERROR',
+    'NOT_FOUND',
+    'POLLING_UNSUPPORTED'
+]
 
 MESSAGE_BINDING = 'urn:taxii.mitre.org:message:xml:1.1'
 SERVICES = 'urn:taxii.mitre.org:services:1.1'
@@ -42,7 +61,9 @@ def poll_request(
         exclusive_begin_timestamp,
         inclusive_end_timestamp,
         message_id=None,
-        subscription_id=None):
+        subscription_id=None,
+        response_type='FULL',
+        allow_asynch=False):
     if message_id is None:
         message_id = new_message_id()
 
@@ -61,7 +82,10 @@ def poll_request(
     result.append('<taxii_11:Inclusive_End_Timestamp>{}</taxii_11:Inclusive_End_Timestamp>'.format(inclusive_end_timestamp))
 
     if subscription_id is None:
-        result.append('<taxii_11:Poll_Parameters allow_asynch="false"><taxii_11:Response_Type>FULL</taxii_11:Response_Type></taxii_11:Poll_Parameters>')
+        result.append('<taxii_11:Poll_Parameters allow_asynch="{}"><taxii_11:Response_Type>{}</taxii_11:Response_Type></taxii_11:Poll_Parameters>'.format(
+            'true' if allow_asynch else 'false',
+            response_type
+        ))
 
     result.append('</taxii_11:Poll_Request>')
 
@@ -76,7 +100,125 @@ def poll_fulfillment_request(result_id, result_part_number, collection_name, mes
                 message_id="{}" collection_name="{}" result_id="{}" result_part_number="{}"/>'''.format(message_id, collection_name, result_id, result_part_number)
 
 
-def headers(content_type=None, accept=None, services=None, protocol=None):
+def iterparse_poll_response(stream):
+    # only the TAXII envelope elements are reported: the start of the
+    # Poll_Response, with all its attributes, and the end of each
+    # Content_Block and of the Status_Message. Everything else inside
+    # the Content_Blocks is just built into the tree.
+    # Content_Blocks are detached from the tree once the caller is
+    # done with them, memory is bounded by the largest Content_Block.
+    # huge_tree lifts the libxml2 limits on the size of the document,
+    # entities are not resolved as they would lift the limits on
+    # entity expansion too
+    events = etree.iterparse(
+        stream,
+        events=('start', 'end'),
+        tag=(POLL_RESPONSE, STATUS_MESSAGE, CONTENT_BLOCK),
+        recover=True,
+        resolve_entities=False,
+        no_network=True,
+        huge_tree=True
+    )
+    for action, element in events:
+        parent = element.getparent()
+
+        if element.tag == POLL_RESPONSE:
+            # Poll_Response is the root of the message
+            if action != 'start' or parent is not None:
+                continue
+
+        elif action != 'end':
+            continue
+
+        elif element.tag == CONTENT_BLOCK:
+            # Content_Blocks are direct children of the Poll_Response
+            if parent is None or parent.tag != POLL_RESPONSE or parent.getparent() is not None:
+                continue
+
+        elif parent is not None:
+            # Status_Message is the root of the message
+            continue
+
+        yield action, element
+
+        if element.tag == CONTENT_BLOCK:
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+def content_block_parts(content_block):
+    # the STIX_Package (first element of Content) and the
+    # Timestamp_Label of a Content_Block, None when missing
+    content = None
+    timestamp_label = None
+
+    for c in content_block:
+        if c.tag == CONTENT:
+            content = next((cc for cc in c if isinstance(cc.tag, basestring)), None)
+
+        elif c.tag == TIMESTAMP_LABEL:
+            timestamp_label = c.text
+
+    return content, timestamp_label
+
+
+def poll_response_more(stream):
+    # reads just the root of the message from stream
+    for _, element in etree.iterparse(stream, events=('start',), recover=True, resolve_entities=False, no_network=True):
+        if element.tag != POLL_RESPONSE:
+            return False
+
+        return parse_more(element.get('more', None))
+
+    return False
+
+
+def parse_record_count(content):
+    # Record_Count of a Poll_Response as (count, partial), None if the
+    # message is not a Poll_Response or has no valid count
+    try:
+        root = etree.fromstring(content, parser=etree.XMLParser(resolve_entities=False))
+    except etree.XMLSyntaxError:
+        return None
+
+    if root.tag != POLL_RESPONSE:
+        return None
+
+    record_count = root.find(RECORD_COUNT)
+    if record_count is None or record_count.text is None:
+        return None
+
+    try:
+        count = int(record_count.text.strip())
+    except ValueError:
+        return None
+
+    partial = record_count.get('partial_count', 'false').lower() in ['true', '1']
+
+    return count, partial
+
+
+def parse_status_detail(status_message):
+    # Status_Detail of a Status_Message element as a dict,
+    # e.g. RESULT_ID and ESTIMATED_WAIT of PENDING messages
+    result = {}
+    for detail in status_message.iterfind(STATUS_DETAIL_ENTRY):
+        name = detail.get('name', None)
+        if name is not None and detail.text is not None:
+            result[name] = detail.text.strip()
+
+    return result
+
+
+def parse_more(more):
+    if not more or more == '0' or more.lower() == 'false':
+        return False
+
+    return True
+
+
+def headers(content_type=None, accept=None, services=None, protocol=None, accept_encoding=None):
     if content_type is None:
         content_type = MESSAGE_BINDING
 
@@ -91,7 +233,7 @@ def headers(content_type=None, accept=None, services=None, protocol=None):
     if protocol in PROTOCOLS:
         protocol = PROTOCOLS[protocol]
 
-    return {
+    result = {
         'Content-Type': 'application/xml',
         'X-TAXII-Content-Type': content_type,
         'X-TAXII-Accept': accept,
@@ -99,15 +241,15 @@ def headers(content_type=None, accept=None, services=None, protocol=None):
         'X-TAXII-Protocol': protocol
     }
 
+    if accept_encoding is not None:
+        result['Accept-Encoding'] = accept_encoding
+
+    return result
+
 
 def parse_timestamp_label(timestamp_label):
     try:
-        dt = dateutil.parser.parse(timestamp_label)
-
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=pytz.UTC)
-        delta = dt - EPOCH
-        return int(delta.total_seconds()*1000)
+        return parse_timestamp(timestamp_label)
 
     except Exception:
         return None
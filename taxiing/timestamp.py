@@ -0,0 +1,84 @@
+import re
+import datetime
+import operator
+
+import pytz
+import dateutil.parser
+
+EPOCH = datetime.datetime.utcfromtimestamp(0).replace(tzinfo=pytz.UTC)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+# strict ISO-8601/RFC-3339 timestamps, anything else is handled
+# by dateutil
+ISO8601 = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?'
+    r'(?:(Z)|([+-])(\d{2})(?::?(\d{2}))?)?$'
+)
+
+MEMO_SIZE = 1024
+_memo = {}
+
+
+def _dateutil_ms(timestamp):
+    dt = dateutil.parser.parse(timestamp)
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=pytz.UTC)
+    delta = dt - EPOCH
+    return int(delta.total_seconds()*1000)
+
+
+def _iso8601_ms(timestamp):
+    m = ISO8601.match(timestamp)
+    if m is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, zulu, sign, tzhour, tzminute = m.groups()
+
+    hour = int(hour)
+    minute = int(minute)
+    second = int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+
+    try:
+        days = datetime.date(int(year), int(month), int(day)).toordinal()-EPOCH_ORDINAL
+    except ValueError:
+        return None
+
+    # like dateutil, fractions are truncated to microseconds
+    microseconds = 0
+    if fraction is not None:
+        microseconds = int(fraction[:6].ljust(6, '0'))
+
+    seconds = hour*3600 + minute*60 + second
+    if sign is not None:
+        offset = int(tzhour)*3600
+        if tzminute is not None:
+            offset += int(tzminute)*60
+        if sign == '-':
+            offset = -offset
+        seconds -= offset
+
+    # same rounding as timedelta.total_seconds()
+    total_microseconds = (days*86400 + seconds)*1000000 + microseconds
+    return int(operator.truediv(total_microseconds, 1000000)*1000)
+
+
+# returns milliseconds since epoch, timestamps with no timezone
+# are UTC. Servers tend to repeat the same timestamps, results are
+# memoized
+def parse_timestamp(timestamp):
+    result = _memo.get(timestamp, None)
+    if result is not None:
+        return result
+
+    result = _iso8601_ms(timestamp)
+    if result is None:
+        result = _dateutil_ms(timestamp)
+
+    if len(_memo) >= MEMO_SIZE:
+        _memo.clear()
+    _memo[timestamp] = result
+
+    return result
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2016 Palo Alto Networks, Inc
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from nose.tools import assert_equal, assert_in, assert_not_in
+
+from taxiing.cache import PackageCache
+
+
+def test_package_cache_lru():
+    cache = PackageCache(2)
+    cache.add('a')
+    cache.add('b')
+    assert_in('a', cache)
+
+    # b is now the least recently seen
+    cache.add('c')
+    assert_not_in('b', cache)
+    assert_equal(cache.fingerprints(), ['a', 'c'])
+
+
+def test_package_cache_restore():
+    cache = PackageCache(2, ['a', 'b', 'c'])
+    assert_equal(len(cache), 2)
+    assert_equal(cache.fingerprints(), ['b', 'c'])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2016 Palo Alto Networks, Inc
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import os.path
+import json
+import shutil
+import tarfile
+import tempfile
+from io import BytesIO
+
+from nose.tools import assert_equal
+from parameterized import parameterized
+
+import taxiing.stix
+import taxiing.ingest
+import taxiing.taxii.v11 as taxii11
+
+MYDIR = os.path.dirname(__file__)
+
+POLL_RESPONSE = '''<taxii_11:Poll_Response xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1"
+    message_id="1" in_response_to="2" collection_name="test">
+    {}
+    <taxii_11:Content_Block>
+        <taxii_11:Content/>
+    </taxii_11:Content_Block>
+</taxii_11:Poll_Response>'''
+
+CONTENT_BLOCK = '''<taxii_11:Content_Block>
+        <taxii_11:Content_Binding binding_id="urn:stix.mitre.org:xml:1.1.1"/>
+        <taxii_11:Content>{}</taxii_11:Content>
+        <taxii_11:Timestamp_Label>2017-11-06T12:12:19.000000+00:00</taxii_11:Timestamp_Label>
+    </taxii_11:Content_Block>'''
+
+
+def stix_packages():
+    testfiles = sorted(
+        f for f in os.listdir(MYDIR)
+        if f.startswith('stix_package_') and f.endswith('.xml')
+    )
+    return [os.path.join(MYDIR, f) for f in testfiles]
+
+
+def expected_lines(prefix=None):
+    result = []
+    for f in stix_packages():
+        with open(f, 'rb') as sf:
+            _, indicators = taxiing.stix.decode(sf.read())
+        result.extend(taxiing.ingest.normalize(indicators, prefix))
+
+    return result
+
+
+def poll_response():
+    blocks = []
+    for f in stix_packages():
+        with open(f, 'rb') as sf:
+            # XML declaration is not allowed inside Content
+            blocks.append(CONTENT_BLOCK.format(sf.read().split('?>', 1)[-1]))
+
+    return POLL_RESPONSE.format('\n'.join(blocks))
+
+
+def ingest(paths, **kwargs):
+    output = BytesIO()
+    statistics = taxiing.ingest.Ingest(output, **kwargs).run(paths)
+    return output.getvalue().splitlines(), statistics
+
+
+def test_normalize():
+    indicators = [{'indicator': '1.1.1.1', 'type': 'IPv4', 'stix_title': 'title', 'share_level': 'green'}]
+    assert_equal(
+        [json.loads(line) for line in taxiing.ingest.normalize(indicators, 'taxii')],
+        [{'indicator': '1.1.1.1', 'value': {'type': 'IPv4', 'taxii_title': 'title', 'share_level': 'green'}}]
+    )
+
+
+def test_root_tag():
+    assert_equal(taxiing.ingest.root_tag(poll_response()[:256]), taxii11.POLL_RESPONSE)
+    assert_equal(taxiing.ingest.root_tag('not xml'), None)
+
+
+def test_peek_stream():
+    stream = taxiing.ingest._PeekStream(BytesIO('a'*(taxiing.ingest.PEEK_SIZE+10)))
+    assert_equal(len(stream.read(10)), 10)
+    assert_equal(len(stream.read()), taxiing.ingest.PEEK_SIZE)
+    assert_equal(stream.bytes, taxiing.ingest.PEEK_SIZE+10)
+
+
+@parameterized([(1,), (2,)])
+def test_ingest(processes):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        packages = os.path.join(tmpdir, 'packages')
+        os.mkdir(packages)
+        for f in stix_packages():
+            shutil.copy(f, packages)
+
+        with open(os.path.join(tmpdir, 'poll_response.xml'), 'wb') as f:
+            f.write(poll_response())
+
+        with open(os.path.join(tmpdir, 'junk.txt'), 'wb') as f:
+            f.write('junk')
+
+        archive = os.path.join(tmpdir, 'packages.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tf:
+            for f in stix_packages():
+                tf.add(f, arcname=os.path.join('packages', os.path.basename(f)))
+
+        expected = expected_lines('taxii')
+        lines, statistics = ingest(
+            [packages, os.path.join(tmpdir, 'poll_response.xml'), os.path.join(tmpdir, 'junk.txt'), archive],
+            prefix='taxii',
+            processes=processes
+        )
+
+        # Poll_Response Content_Blocks are decoded as standalone packages
+        assert_equal(lines, expected*3)
+        assert_equal(statistics['files'], 2*len(stix_packages())+2)
+        assert_equal(statistics['packages'], 3*len(stix_packages()))
+        assert_equal(statistics['indicators'], 3*len(expected))
+        assert_equal(statistics['skipped'], 1)
+        assert_equal(statistics['errors'], 0)
+
+    finally:
+        shutil.rmtree(tmpdir)
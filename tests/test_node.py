@@ -0,0 +1,1031 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2016 Palo Alto Networks, Inc
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import sys
+import json
+import time
+import socket
+import types
+import tempfile
+import collections
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from datetime import datetime, timedelta
+
+import gevent
+import mock
+import pytz
+import requests
+import yaml
+from nose.tools import assert_equal, assert_greater, assert_less, assert_is, assert_is_none, assert_is_not_none, assert_raises, assert_true
+from parameterized import parameterized
+from lxml import etree
+
+import taxiing.stix
+import taxiing.taxii.v11 as taxii11
+from benchmarks.taxiiserver import TAXIIServer
+
+MYDIR = os.path.dirname(__file__)
+
+
+def _install_minemeld_stub():
+    # minimal BasePollerFT, enough to drive the Miner polls without
+    # a MineMeld engine
+    class BasePollerFT(object):
+        def __init__(self, name, chassis, config):
+            self.name = name
+            self.chassis = chassis
+            self.config = config
+            self.statistics = collections.defaultdict(int)
+            self.configure()
+
+        def configure(self):
+            pass
+
+        def stop(self):
+            pass
+
+        def hup(self, source=None):
+            pass
+
+        def _saved_state_restore(self, saved_state):
+            pass
+
+        def _saved_state_create(self):
+            return {}
+
+        def _saved_state_reset(self):
+            pass
+
+        def _flush(self):
+            pass
+
+        @staticmethod
+        def gc(name, config=None):
+            pass
+
+    def interval_in_sec(interval):
+        if isinstance(interval, int):
+            return interval
+
+        multipliers = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        if interval[-1] not in multipliers:
+            return None
+
+        return int(interval[:-1])*multipliers[interval[-1]]
+
+    modules = dict(
+        (name, types.ModuleType(name))
+        for name in ['minemeld', 'minemeld.ft', 'minemeld.ft.basepoller', 'minemeld.ft.utils']
+    )
+    modules['minemeld'].ft = modules['minemeld.ft']
+    modules['minemeld.ft'].basepoller = modules['minemeld.ft.basepoller']
+    modules['minemeld.ft'].utils = modules['minemeld.ft.utils']
+    modules['minemeld.ft.basepoller'].BasePollerFT = BasePollerFT
+    modules['minemeld.ft.utils'].interval_in_sec = interval_in_sec
+    sys.modules.update(modules)
+
+
+try:
+    import minemeld.ft.basepoller  # noqa
+except ImportError:
+    _install_minemeld_stub()
+
+os.environ.setdefault('MM_CONFIG_DIR', tempfile.mkdtemp())
+
+from taxiing.node import Miner
+from taxiing.node import _timed_stix_decode as timed_stix_decode
+
+POLL_SERVICE = 'http://taxii.example.com/poll'
+
+BEGIN = datetime(2017, 11, 1, tzinfo=pytz.UTC)
+
+POLL_RESPONSE_HEADER = '<taxii_11:Poll_Response xmlns:taxii_11="{}" message_id="1" in_response_to="1" ' \
+    'collection_name="{}" result_id="{}" result_part_number="{}" more="{}">'
+
+CONTENT_BLOCK = '<taxii_11:Content_Block><taxii_11:Content_Binding binding_id="urn:stix.mitre.org:xml:1.1.1"/>' \
+    '<taxii_11:Content>{}</taxii_11:Content><taxii_11:Timestamp_Label>{}</taxii_11:Timestamp_Label>' \
+    '</taxii_11:Content_Block>'
+
+# one domain indicator per package
+DOMAIN_PACKAGE = '<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" xmlns:cybox="http://cybox.mitre.org/cybox-2" ' \
+    'xmlns:DomainNameObj="http://cybox.mitre.org/objects#DomainNameObject-1" ' \
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" id="example:package-{0}" version="1.1.1">' \
+    '<stix:Observables cybox_major_version="2" cybox_minor_version="1"><cybox:Observable id="example:observable-{0}">' \
+    '<cybox:Object><cybox:Properties xsi:type="DomainNameObj:DomainNameObjectType" type="FQDN">' \
+    '<DomainNameObj:Value>host{0}.example.com</DomainNameObj:Value></cybox:Properties></cybox:Object>' \
+    '</cybox:Observable></stix:Observables></stix:STIX_Package>'
+
+# an IPv6 address with the IPv4 category
+ADDRESS_PACKAGE = '<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" xmlns:cybox="http://cybox.mitre.org/cybox-2" ' \
+    'xmlns:AddressObj="http://cybox.mitre.org/objects#AddressObject-2" ' \
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" id="example:package-1" version="1.1.1">' \
+    '<stix:Observables cybox_major_version="2" cybox_minor_version="1"><cybox:Observable id="example:observable-1">' \
+    '<cybox:Object><cybox:Properties xsi:type="AddressObj:AddressObjectType" category="ipv4-addr">' \
+    '<AddressObj:Address_Value>2001:db8::1</AddressObj:Address_Value></cybox:Properties></cybox:Object>' \
+    '</cybox:Observable></stix:Observables></stix:STIX_Package>'
+
+CONTENT_BLOCK_END = '</taxii_11:Content_Block>'
+
+STATUS_MESSAGE = '<taxii_11:Status_Message xmlns:taxii_11="{}" message_id="1" in_response_to="1" status_type="{}"/>'
+
+PENDING_MESSAGE = '<taxii_11:Status_Message xmlns:taxii_11="{}" message_id="1" in_response_to="1" status_type="PENDING">' \
+    '<taxii_11:Status_Detail><taxii_11:Detail name="RESULT_ID">{}</taxii_11:Detail>' \
+    '<taxii_11:Detail name="ESTIMATED_WAIT">{}</taxii_11:Detail></taxii_11:Status_Detail></taxii_11:Status_Message>'
+
+RECORD_COUNT = '<taxii_11:Record_Count partial_count="false">{}</taxii_11:Record_Count>'
+
+
+def stix_packages():
+    testfiles = sorted(
+        f for f in os.listdir(MYDIR)
+        if f.startswith('stix_package_') and f.endswith('.xml')
+    )
+
+    result = []
+    for f in testfiles:
+        with open(os.path.join(MYDIR, f), 'rb') as sf:
+            # XML declaration is not allowed inside Content
+            result.append(sf.read().split('?>', 1)[-1])
+
+    return result
+
+
+class TimeoutStream(BytesIO):
+    # the connection times out after size bytes
+    def __init__(self, content, size):
+        BytesIO.__init__(self, content[:size])
+
+    def read(self, *args):
+        result = BytesIO.read(self, *args)
+        if len(result) == 0:
+            raise socket.timeout('timed out')
+
+        return result
+
+
+class FakeResponse(object):
+    def __init__(self, content, timeout_after=None, elapsed=timedelta(0)):
+        self.content = content
+        self.elapsed = elapsed
+        self.raw = BytesIO(content)
+        if timeout_after is not None:
+            self.raw = TimeoutStream(content, timeout_after)
+
+    def close(self):
+        pass
+
+
+class FakeTAXII(object):
+    # in memory TAXII 1.1 poll service, replaces Miner._send_request.
+    # blocks is a list of (timestamp label, STIX package), each
+    # poll returns the blocks in the window in parts of
+    # blocks_per_part blocks. failures maps a part number to the
+    # number of content blocks sent before the connection times out,
+    # each failure happens once. The first pending asynch polls and
+    # Poll_Fulfillments are answered with PENDING. latency is the
+    # time to the first byte of each poll response
+    def __init__(self, blocks, blocks_per_part=10, collection='test', count_only=False):
+        self.blocks = blocks
+        self.blocks_per_part = blocks_per_part
+        self.collection = collection
+        self.count_only = count_only
+        self.results = {}
+        self.requests = []
+        self.fulfillments = []
+        self.failures = {}
+        self.pending = 0
+        self.estimated_wait = 5
+        self.latency = timedelta(0)
+        self.count_requests = 0
+
+    def send_request(self, url, headers, data, stream=False):
+        request = etree.fromstring(data)
+        message = request.tag.rsplit('}', 1)[-1]
+        self.requests.append(message)
+
+        if message == 'Poll_Request':
+            begin = request.findtext('{{{}}}Exclusive_Begin_Timestamp'.format(taxii11.NAMESPACE))
+            end = request.findtext('{{{}}}Inclusive_End_Timestamp'.format(taxii11.NAMESPACE))
+            begin = taxii11.parse_timestamp_label(begin)
+            end = taxii11.parse_timestamp_label(end)
+
+            blocks = [
+                (label, package) for label, package in self.blocks
+                if begin < taxii11.parse_timestamp_label(label) <= end
+            ]
+
+            parameters = request.find('{{{}}}Poll_Parameters'.format(taxii11.NAMESPACE))
+            response_type = parameters.findtext('{{{}}}Response_Type'.format(taxii11.NAMESPACE))
+            if self.count_only and response_type == 'COUNT_ONLY':
+                self.count_requests += 1
+                content = POLL_RESPONSE_HEADER.format(taxii11.NAMESPACE, self.collection, '', 1, 'false')
+                content += RECORD_COUNT.format(len(blocks))
+                return FakeResponse(content+'</taxii_11:Poll_Response>')
+
+            result_id = 'r{}'.format(len(self.results)+1)
+            self.results[result_id] = blocks
+
+            if parameters.get('allow_asynch') == 'true' and self.pending > 0:
+                self.pending -= 1
+                return FakeResponse(PENDING_MESSAGE.format(taxii11.NAMESPACE, result_id, self.estimated_wait))
+
+            return self.response(result_id, 1)
+
+        if message == 'Poll_Fulfillment':
+            result_id = request.get('result_id')
+            result_part_number = int(request.get('result_part_number'))
+            self.fulfillments.append((result_id, result_part_number))
+            if result_id not in self.results:
+                return FakeResponse(STATUS_MESSAGE.format(taxii11.NAMESPACE, 'NOT_FOUND'))
+
+            if result_part_number == 1 and self.pending > 0:
+                self.pending -= 1
+                return FakeResponse(PENDING_MESSAGE.format(taxii11.NAMESPACE, result_id, self.estimated_wait))
+
+            return self.response(result_id, result_part_number)
+
+        raise RuntimeError('unexpected request {}'.format(message))
+
+    def num_parts(self, result_id):
+        return max(1, (len(self.results[result_id])+self.blocks_per_part-1)/self.blocks_per_part)
+
+    def response(self, result_id, result_part_number):
+        content = self.poll_response(result_id, result_part_number)
+
+        timeout_after = None
+        if result_part_number in self.failures:
+            # right after the Poll_Response start tag and the blocks sent
+            timeout_after = content.index('>')+1
+            for _ in range(self.failures.pop(result_part_number)):
+                timeout_after = content.index(CONTENT_BLOCK_END, timeout_after)+len(CONTENT_BLOCK_END)
+
+        return FakeResponse(content, timeout_after, self.latency)
+
+    def poll_response(self, result_id, result_part_number):
+        start = (result_part_number-1)*self.blocks_per_part
+        blocks = self.results[result_id][start:start+self.blocks_per_part]
+
+        return POLL_RESPONSE_HEADER.format(
+            taxii11.NAMESPACE,
+            self.collection,
+            result_id,
+            result_part_number,
+            'true' if result_part_number < self.num_parts(result_id) else 'false'
+        ) + ''.join(CONTENT_BLOCK.format(package, label) for label, package in blocks) + '</taxii_11:Poll_Response>'
+
+
+def timestamp_label(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def hourly_blocks(packages, hours=24):
+    # one block per package per hour
+    result = []
+    for h in range(hours):
+        label = timestamp_label(BEGIN+timedelta(hours=h, minutes=30))
+        result.extend((label, p) for p in packages)
+
+    return result
+
+
+def domain_blocks(labels, first=0):
+    # one block per label, each with a different indicator
+    return [(label, DOMAIN_PACKAGE.format(n)) for n, label in enumerate(labels, first)]
+
+
+def hourly_labels(hours, per_hour):
+    result = []
+    for h in range(hours):
+        result.extend([timestamp_label(BEGIN+timedelta(hours=h, minutes=30))]*per_hour)
+
+    return result
+
+
+class FakeTAXIICollections(object):
+    # requests are routed to the FakeTAXII of their collection
+    def __init__(self, servers):
+        self.servers = dict((server.collection, server) for server in servers)
+
+    def send_request(self, url, headers, data, stream=False):
+        collection = etree.fromstring(data).get('collection_name')
+        return self.servers[collection].send_request(url, headers, data, stream=stream)
+
+
+def new_miner(server, **config):
+    config.setdefault('poll_service', POLL_SERVICE)
+    if 'collections' not in config:
+        config.setdefault('collection', server.collection)
+    miner = Miner('test', None, config)
+    miner._send_request = server.send_request
+
+    return miner
+
+
+def poll_iterator(miner, begin=BEGIN, end=None):
+    # emitted indicators, as MineMeld attribute dicts
+    if end is None:
+        end = begin+timedelta(days=1)
+
+    state = miner.collection_states.values()[0]
+    for i in miner._run_poll(miner._incremental_poll_collection(state, POLL_SERVICE, begin, end)):
+        yield miner._process_item(i)[0]
+
+
+def poll(miner, begin=BEGIN, end=None):
+    return list(poll_iterator(miner, begin, end))
+
+
+def poll_collections(miner, now=BEGIN+timedelta(days=1)):
+    # a full poll of all the collections, from now-initial_interval
+    now = int((now-taxii11.EPOCH).total_seconds()*1000)
+    return [miner._process_item(i)[0] for i in miner._build_iterator(now)]
+
+
+def interrupted_poll(server, end=None, **config):
+    # the first poll fails, the second one is run by a new node
+    # restored from the saved state of the first one
+    miner = new_miner(server, **config)
+    emitted = []
+    try:
+        for i in poll_iterator(miner, end=end):
+            emitted.append(i)
+
+    except socket.timeout:
+        pass
+
+    saved_state = json.loads(json.dumps(miner._saved_state_create()))
+
+    miner = new_miner(server, **config)
+    miner._saved_state_restore(saved_state)
+    emitted.extend(poll(miner, end=end))
+
+    return emitted, miner
+
+
+def indicator_set(emitted):
+    return set((indicator, value['type']) for indicator, value in emitted)
+
+
+class HubTicker(object):
+    # longest time other greenlets could not run
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.ticks = 0
+        self.max_gap = 0.0
+        self.last = None
+        self.glet = None
+
+    def _run(self):
+        while True:
+            gevent.sleep(self.interval)
+            self._tick()
+            self.ticks += 1
+
+    def _tick(self):
+        now = time.time()
+        self.max_gap = max(self.max_gap, now-self.last)
+        self.last = now
+
+    def start(self):
+        self.last = time.time()
+        self.glet = gevent.spawn(self._run)
+
+    def stop(self):
+        self.glet.kill()
+        self._tick()
+
+
+def test_decode_processes_limited():
+    with mock.patch('multiprocessing.cpu_count', return_value=1):
+        miner = new_miner(FakeTAXII([]), decode_processes=2)
+
+    assert_equal(miner.decode_processes, 0)
+
+
+@mock.patch('multiprocessing.cpu_count', return_value=4)
+def test_decode_pool(cpu_count):
+    server = FakeTAXII(hourly_blocks(stix_packages()))
+    expected = poll(new_miner(server))
+
+    miner = new_miner(server, decode_processes=2)
+    try:
+        assert_equal(poll(miner), expected)
+        pool = miner._decode_pool
+
+        # the pool is kept across polls
+        assert_equal(poll(miner), expected)
+        assert_is(miner._decode_pool, pool)
+
+    finally:
+        miner.stop()
+
+    assert_is_none(miner._decode_pool)
+
+
+@parameterized([
+    (True, 0, 'IPv6'),
+    (False, 0, 'IPv4'),
+    (True, 2, 'IPv6'),
+    (False, 2, 'IPv4')
+])
+@mock.patch('multiprocessing.cpu_count', return_value=4)
+def test_ip_version_auto_detect(ip_version_auto_detect, decode_processes, type_, cpu_count):
+    server = FakeTAXII([(timestamp_label(BEGIN+timedelta(hours=1)), ADDRESS_PACKAGE)])
+    miner = new_miner(server, ip_version_auto_detect=ip_version_auto_detect, decode_processes=decode_processes)
+    try:
+        assert_equal(indicator_set(poll(miner)), set([('2001:db8::1', type_)]))
+
+    finally:
+        miner.stop()
+
+
+def slow_stix_decode(content, options):
+    # runs in the decode pool
+    time.sleep(0.1)
+    return timed_stix_decode(content, options)
+
+
+@mock.patch('multiprocessing.cpu_count', return_value=4)
+def test_decode_pool_cooperative(cpu_count):
+    # other greenlets keep running while blocks are decoded
+    # by the pool
+    server = FakeTAXII(hourly_blocks(stix_packages(), hours=2))
+    miner = new_miner(server, decode_processes=2)
+
+    ticker = HubTicker()
+    with mock.patch('taxiing.node._timed_stix_decode', slow_stix_decode):
+        ticker.start()
+        try:
+            poll(miner)
+
+        finally:
+            ticker.stop()
+            miner.stop()
+
+    assert_greater(ticker.ticks, 0)
+    assert_less(ticker.max_gap, 0.2)
+
+
+def test_concurrent_poll_windows():
+    server = FakeTAXII(hourly_blocks(stix_packages()))
+    expected = poll(new_miner(server, max_poll_dt=3600))
+
+    miner = new_miner(server, max_poll_dt=3600, poll_concurrency=3)
+    assert_equal(poll(miner), expected)
+    assert_equal(miner.collection_states['test']['last_taxii_run'], 1509579000000)
+
+
+def test_concurrent_poll_windows_buffer():
+    # indicators read ahead by the windows polled in background
+    # are bounded by poll_window_buffer
+    package = stix_packages()[0]
+    server = FakeTAXII(hourly_blocks([package]*50), blocks_per_part=100)
+    miner = new_miner(server, max_poll_dt=3600, poll_concurrency=3, poll_window_buffer=5)
+
+    produced = [0]
+    content_block_decoded = miner._content_block_decoded
+
+    def counting_content_block_decoded(*args):
+        for i in content_block_decoded(*args):
+            produced[0] += 1
+            yield i
+
+    miner._content_block_decoded = counting_content_block_decoded
+
+    state = miner.collection_states['test']
+    consumed = 0
+    for i in miner._run_poll(miner._incremental_poll_collection(state, POLL_SERVICE, BEGIN, BEGIN+timedelta(days=1))):
+        consumed += 1
+        assert_less(produced[0]-consumed, 3*(5+1)+1)
+        gevent.sleep(0)
+
+    assert_equal(consumed, 24*50)
+
+
+class SpoolTracker(object):
+    # spools created for the prefetched parts
+    def __init__(self):
+        self.spools = []
+
+    def __call__(self, *args, **kwargs):
+        spool = SpooledTemporaryFile(*args, **kwargs)
+        self.spools.append(spool)
+        return spool
+
+
+def prefetched_poll(miner, limit=None):
+    # other greenlets run between indicators, as in the engine
+    emitted = []
+    iterator = poll_iterator(miner)
+    try:
+        for i in iterator:
+            emitted.append(i)
+            gevent.sleep(0)
+            if limit is not None and len(emitted) == limit:
+                break
+
+    finally:
+        iterator.close()
+
+    return emitted
+
+
+@mock.patch('taxiing.node.tempfile.SpooledTemporaryFile', new_callable=SpoolTracker)
+def test_prefetch_parts(spools):
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 2)), blocks_per_part=8)
+    expected = poll(new_miner(server))
+
+    server.fulfillments = []
+    emitted = prefetched_poll(new_miner(server, prefetch_parts=3))
+
+    assert_equal(emitted, expected)
+    assert_equal(server.fulfillments, [('r2', n) for n in range(2, 7)])
+    assert_equal(len(spools.spools), 5)
+    assert_true(all(spool.closed for spool in spools.spools))
+
+
+@mock.patch('taxiing.node.tempfile.SpooledTemporaryFile', new_callable=SpoolTracker)
+def test_prefetch_parts_error(spools):
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 2)), blocks_per_part=8)
+    expected = poll(new_miner(server))
+
+    # the third part times out while prefetched
+    server.failures[3] = 4
+    miner = new_miner(server, prefetch_parts=2)
+    assert_raises(socket.timeout, prefetched_poll, miner)
+    assert_true(all(spool.closed for spool in spools.spools))
+
+    # the poll is resumed after the last part emitted
+    checkpoint = miner.collection_states['test']['poll_checkpoint']
+    assert_equal((checkpoint['result_id'], checkpoint['result_part_number']), ('r2', 2))
+
+    emitted = poll(miner)
+    assert_equal(indicator_set(emitted), indicator_set(expected[16:]))
+
+
+@mock.patch('taxiing.node.tempfile.SpooledTemporaryFile', new_callable=SpoolTracker)
+def test_prefetch_parts_result_id_changed(spools):
+    class RestartingTAXII(FakeTAXII):
+        # the second part is answered from a new result set
+        def response(self, result_id, result_part_number):
+            if result_id == 'r1' and result_part_number == 2:
+                self.results['r2'] = self.results['r1']
+                result_id = 'r2'
+
+            return FakeTAXII.response(self, result_id, result_part_number)
+
+    server = RestartingTAXII(domain_blocks(hourly_labels(24, 2)), blocks_per_part=8)
+    expected = poll(new_miner(FakeTAXII(server.blocks, blocks_per_part=8)))
+
+    emitted = prefetched_poll(new_miner(server, prefetch_parts=3))
+
+    assert_equal(emitted, expected)
+    # the parts prefetched from the first result set are dropped
+    assert_equal(server.fulfillments[:3], [('r1', 2), ('r1', 3), ('r1', 4)])
+    assert_equal(server.fulfillments[3:], [('r2', n) for n in range(3, 7)])
+    assert_true(all(spool.closed for spool in spools.spools))
+
+
+@mock.patch('taxiing.node.tempfile.SpooledTemporaryFile', new_callable=SpoolTracker)
+def test_prefetch_parts_aborted(spools):
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 2)), blocks_per_part=8)
+    miner = new_miner(server, prefetch_parts=3)
+
+    assert_equal(len(prefetched_poll(miner, limit=4)), 4)
+    assert_greater(len(spools.spools), 0)
+    assert_true(all(spool.closed for spool in spools.spools))
+
+
+def test_hup_closes_session():
+    miner = new_miner(FakeTAXII([]))
+    session = mock.Mock()
+    miner._session = session
+
+    miner.hup()
+
+    session.close.assert_called_once_with()
+    assert_is_none(miner._session)
+
+
+@mock.patch.dict(os.environ, {'REQUESTS_CA_BUNDLE': '/etc/ssl/certs/ca-certificates.crt'})
+@mock.patch('requests.adapters.HTTPAdapter.send')
+def test_verify_cert(send):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = BytesIO('')
+    send.return_value = response
+
+    miner = Miner('test', None, dict(poll_service=POLL_SERVICE, collection='test', verify_cert=False))
+    miner._send_request(POLL_SERVICE, {}, '')
+
+    assert_is(send.call_args[1]['verify'], False)
+
+
+def profiled_poll(miner):
+    # number of profiles saved by a poll
+    miner.profile_dir = tempfile.mkdtemp()
+    poll_collections(miner)
+    return len(os.listdir(miner.profile_dir))
+
+
+def test_profile_next_poll_side_config():
+    server = FakeTAXII([])
+    side_config_path = os.path.join(os.environ['MM_CONFIG_DIR'], 'test_side_config.yml')
+    with open(side_config_path, 'w') as f:
+        yaml.safe_dump({'profile_next_poll': True, 'verify_cert': False}, f)
+
+    try:
+        miner = new_miner(server)
+        assert_is(miner.profile_next_poll, True)
+
+        # the trigger is removed from the side config once consumed
+        with open(side_config_path, 'r') as f:
+            assert_equal(yaml.safe_load(f), {'verify_cert': False})
+
+        assert_equal(profiled_poll(miner), 1)
+        miner.hup()
+        assert_equal(profiled_poll(miner), 0)
+
+        # a restart does not turn profiling on again
+        assert_equal(profiled_poll(new_miner(server)), 0)
+
+    finally:
+        os.remove(side_config_path)
+
+
+def test_profile_next_poll_trigger():
+    server = FakeTAXII([])
+    miner = new_miner(server, profile_next_poll='1')
+
+    assert_equal(profiled_poll(miner), 1)
+    assert_equal(profiled_poll(miner), 0)
+
+    # the consumed trigger is kept in the saved state
+    saved_state = json.loads(json.dumps(miner._saved_state_create()))
+    miner = new_miner(server, profile_next_poll='1')
+    miner._saved_state_restore(saved_state)
+    assert_equal(profiled_poll(miner), 0)
+
+    # a new trigger value profiles the next poll
+    miner = new_miner(server, profile_next_poll='2')
+    miner._saved_state_restore(saved_state)
+    assert_equal(profiled_poll(miner), 1)
+
+
+def test_resume_interrupted_poll():
+    server = FakeTAXII(domain_blocks(hourly_labels(6, 8)), blocks_per_part=8)
+    expected = poll(new_miner(server))
+
+    server.failures[3] = 4
+    server.requests = []
+    emitted, miner = interrupted_poll(server)
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+    # the result set is resumed from the interrupted part
+    assert_equal(server.requests[:5], ['Poll_Request', 'Poll_Fulfillment', 'Poll_Fulfillment', 'Poll_Fulfillment', 'Poll_Fulfillment'])
+    assert_is_none(miner.collection_states['test']['poll_checkpoint'])
+
+
+def test_resume_expired_result():
+    server = FakeTAXII(domain_blocks(hourly_labels(6, 8)), blocks_per_part=8)
+    expected = poll(new_miner(server))
+
+    server.failures[3] = 4
+    miner = new_miner(server)
+    emitted = []
+    try:
+        for i in poll_iterator(miner):
+            emitted.append(i)
+
+    except socket.timeout:
+        pass
+
+    saved_state = json.loads(json.dumps(miner._saved_state_create()))
+
+    # the result set is NOT_FOUND, the window is polled again
+    server.results.clear()
+    miner = new_miner(server)
+    miner._saved_state_restore(saved_state)
+    miner._invalidate_poll_service = mock.Mock()
+    emitted.extend(poll(miner))
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+    assert_equal(miner._invalidate_poll_service.call_count, 0)
+
+
+def test_resume_interrupted_poll_coalesced():
+    # coalesced indicators of the parts already read are lost
+    # if the checkpoint moves past them
+    server = FakeTAXII(domain_blocks(hourly_labels(6, 8)), blocks_per_part=8)
+    expected = poll(new_miner(server, coalesce_indicators=True))
+
+    server.failures[3] = 4
+    emitted, _ = interrupted_poll(server, coalesce_indicators=True)
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+
+
+def test_resume_shared_timestamp_label():
+    # a single part response interrupted between blocks with the
+    # same timestamp label
+    server = FakeTAXII(domain_blocks(hourly_labels(1, 8)), blocks_per_part=100)
+    expected = poll(new_miner(server))
+
+    server.failures[1] = 5
+    emitted, _ = interrupted_poll(server)
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+
+
+def test_resume_after_completed_label():
+    server = FakeTAXII(domain_blocks(hourly_labels(2, 8)), blocks_per_part=100)
+    expected = poll(new_miner(server))
+
+    server.failures[1] = 12
+    emitted, _ = interrupted_poll(server)
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+    # the blocks of the first hour are not polled again
+    assert_equal(len(server.results['r3']), 8)
+
+
+def test_package_cache():
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 2)))
+    miner = new_miner(server, package_cache_size=1000, initial_interval=86400)
+
+    assert_equal(len(poll_collections(miner)), 48)
+    # the packages of the first poll are skipped
+    miner.collection_states['test']['last_taxii_run'] = None
+    assert_equal(len(poll_collections(miner)), 0)
+    assert_equal(miner.statistics['package_cache.hit'], 48)
+
+    # and emitted again after a flush
+    miner._flush()
+    assert_equal(len(poll_collections(miner)), 48)
+
+
+def test_adaptive_poll_window():
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 4)), blocks_per_part=100)
+    miner = new_miner(server, adaptive_poll_window=True, adaptive_target_blocks=10, min_poll_dt=3600)
+    state = miner.collection_states['test']
+
+    assert_equal(len(poll(miner)), 96)
+    # too many blocks in the window
+    assert_equal(state['poll_dt'], 43200)
+
+    assert_equal(len(poll(miner, begin=BEGIN+timedelta(days=1))), 0)
+    # a full window under a quarter of the targets
+    assert_equal(state['poll_dt'], 86400)
+
+
+def test_adaptive_poll_window_latency():
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 1)), blocks_per_part=10)
+    server.latency = timedelta(seconds=2)
+    miner = new_miner(server, adaptive_poll_window=True, adaptive_target_time=5, min_poll_dt=3600)
+
+    # 3 parts
+    poll(miner)
+    assert_equal(miner.collection_states['test']['poll_dt'], 43200)
+
+
+def test_adaptive_poll_window_slow_consumer():
+    # the time spent processing the indicators does not narrow the window
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 1)), blocks_per_part=100)
+    miner = new_miner(server, adaptive_poll_window=True, adaptive_target_time=0.05, min_poll_dt=3600)
+
+    for _ in poll_iterator(miner):
+        time.sleep(0.01)
+
+    assert_equal(miner.collection_states['test']['poll_dt'], 86400)
+
+
+def test_adaptive_poll_window_bisect():
+    # the window timing out is polled again in halves
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 4)), blocks_per_part=100)
+    expected = poll(new_miner(server))
+
+    server.failures[1] = 10
+    miner = new_miner(server, adaptive_poll_window=True, min_poll_dt=3600)
+    emitted = poll(miner)
+
+    assert_equal(indicator_set(emitted), indicator_set(expected))
+    assert_equal(miner.statistics['poll.bisected'], 1)
+    assert_equal(miner.collection_states['test']['timed_out_poll_dt'], 86400)
+
+
+def test_adaptive_poll_window_bisect_min_poll_dt():
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 4)), blocks_per_part=100)
+    server.failures[1] = 10
+    miner = new_miner(server, adaptive_poll_window=True, min_poll_dt=86400)
+
+    assert_raises(socket.timeout, poll, miner)
+
+
+def collection_servers():
+    return [
+        FakeTAXII(domain_blocks(hourly_labels(24, 2)), collection='a'),
+        FakeTAXII(domain_blocks(hourly_labels(12, 2), first=100), collection='b')
+    ]
+
+
+@parameterized([(1,), (2,)])
+def test_poll_collections(collection_concurrency):
+    servers = collection_servers()
+    miner = new_miner(
+        FakeTAXIICollections(servers),
+        collections=['a', 'b'],
+        collection_concurrency=collection_concurrency,
+        initial_interval=86400
+    )
+
+    emitted = poll_collections(miner)
+
+    assert_equal(len(emitted), 48+24)
+    tags = collections.Counter(value['taxii_collection'] for _, value in emitted)
+    assert_equal(tags, {'a': 48, 'b': 24})
+    assert_equal(
+        [(c, state['last_taxii_run']) for c, state in miner.collection_states.iteritems()],
+        [('a', 1509579000000), ('b', 1509535800000)]
+    )
+
+
+def test_poll_collections_error():
+    # a failing collection does not stop the others
+    servers = collection_servers()
+    servers[0].failures[1] = 3
+    miner = new_miner(FakeTAXIICollections(servers), collections=['a', 'b'], initial_interval=86400)
+
+    emitted = []
+    try:
+        for i in miner._build_iterator(int((BEGIN+timedelta(days=1)-taxii11.EPOCH).total_seconds()*1000)):
+            emitted.append(miner._process_item(i)[0])
+
+    except socket.timeout:
+        pass
+
+    else:
+        raise AssertionError('collection error not raised')
+
+    assert_equal(collections.Counter(value['taxii_collection'] for _, value in emitted), {'a': 3, 'b': 24})
+    assert_is_none(miner.collection_states['a']['last_taxii_run'])
+    assert_equal(miner.collection_states['b']['last_taxii_run'], 1509535800000)
+
+
+def test_poll_collections_not_found():
+    # a collection missing from the discovery does not stop the others
+    server = TAXIIServer(stix_packages(), blocks_per_part=3).start()
+    try:
+        miner = Miner('test', None, dict(
+            discovery_service=server.discovery_service,
+            collections=['missing', server.collection],
+            initial_interval=3600
+        ))
+        emitted = []
+        try:
+            for i in miner._build_iterator(int(time.time()*1000)):
+                emitted.append(miner._process_item(i)[0])
+
+        except RuntimeError as e:
+            assert_equal(str(e), 'test - collection missing not found')
+
+        else:
+            raise AssertionError('discovery error not raised')
+
+        # the server handlers wait on the kept alive connections
+        miner._session.close()
+
+    finally:
+        server.stop()
+
+    assert_greater(len(emitted), 0)
+    assert_is_none(miner.collection_states['missing']['last_taxii_run'])
+    assert_is_not_none(miner.collection_states[server.collection]['last_taxii_run'])
+
+
+def test_collections_saved_state():
+    servers = collection_servers()
+    miner = new_miner(FakeTAXIICollections(servers), collections=['a', 'b'], initial_interval=86400)
+    poll_collections(miner)
+
+    saved_state = json.loads(json.dumps(miner._saved_state_create()))
+
+    # a new collection starts from initial_interval
+    miner = new_miner(FakeTAXIICollections(servers), collections=['a', 'b', 'c'], initial_interval=86400)
+    miner._saved_state_restore(saved_state)
+    assert_equal(
+        [(c, state['last_taxii_run']) for c, state in miner.collection_states.iteritems()],
+        [('a', 1509579000000), ('b', 1509535800000), ('c', None)]
+    )
+
+
+def test_legacy_saved_state():
+    # state saved by a single collection node
+    miner = new_miner(FakeTAXII([]), adaptive_poll_window=True)
+    miner._saved_state_restore(dict(last_taxii_run=1509535800000, poll_dt=7200, poll_checkpoint=None))
+
+    state = miner.collection_states['test']
+    assert_equal(state['last_taxii_run'], 1509535800000)
+    assert_equal(state['poll_dt'], 7200)
+
+
+def test_count_only_planning():
+    # a day with blocks in two hours only
+    labels = [timestamp_label(BEGIN+timedelta(hours=3, minutes=10))]*5 + [timestamp_label(BEGIN+timedelta(hours=20, minutes=10))]*5
+    server = FakeTAXII(domain_blocks(labels), count_only=True)
+    miner = new_miner(server, count_only_planning=True, max_poll_dt=3600)
+
+    assert_equal(len(poll(miner)), 10)
+    # two FULL polls instead of 24
+    assert_equal(len(server.results), 2)
+    assert_greater(miner.statistics['planning.skipped_ranges'], 0)
+    assert_equal(miner.statistics['planning.count_requests'], server.count_requests)
+
+
+def test_count_only_planning_dense():
+    # ranges above planning_target_blocks are split down to min_poll_dt
+    server = FakeTAXII(domain_blocks(hourly_labels(4, 10)), count_only=True)
+    miner = new_miner(server, count_only_planning=True, planning_target_blocks=15, min_poll_dt=3600)
+
+    assert_equal(len(poll(miner, end=BEGIN+timedelta(hours=4))), 40)
+    assert_equal([len(blocks) for _, blocks in sorted(server.results.items())], [10, 10, 10, 10])
+
+
+def test_count_only_planning_not_supported():
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 1)))
+    miner = new_miner(server, count_only_planning=True, max_poll_dt=3600)
+
+    assert_equal(len(poll(miner)), 24)
+    # the answer to the first COUNT_ONLY poll has no Record_Count
+    assert_equal(miner.statistics['planning.count_requests'], 1)
+    assert_equal(len(server.results), 25)
+
+
+@mock.patch('gevent.sleep')
+def test_asynch_poll(sleep):
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 1)))
+    expected = poll(new_miner(server))
+
+    server.pending = 2
+    miner = new_miner(server, asynch_polling=True)
+
+    assert_equal(poll(miner), expected)
+    assert_equal(miner.statistics['asynch.pending'], 2)
+    assert_equal(sleep.call_args_list, [mock.call(5), mock.call(5)])
+
+
+@mock.patch('gevent.sleep')
+def test_asynch_poll_max_wait(sleep):
+    server = FakeTAXII(domain_blocks(hourly_labels(24, 1)))
+    server.pending = 10
+    miner = new_miner(server, asynch_polling=True, asynch_max_wait=12)
+
+    assert_raises(RuntimeError, poll, miner)
+    # the last wait is cut to the remaining time
+    assert_equal(sleep.call_args_list, [mock.call(5), mock.call(5), mock.call(2)])
+
+
+def test_miner_taxii_server():
+    # discovery and polls over HTTP
+    packages = stix_packages()
+    server = TAXIIServer(packages, blocks_per_part=3).start()
+    try:
+        miner = Miner('test', None, dict(
+            discovery_service=server.discovery_service,
+            collection=server.collection,
+            initial_interval=3600,
+            compressed_transfer=True
+        ))
+        now = int(time.time()*1000)
+        emitted = [miner._process_item(i)[0] for i in miner._build_iterator(now)]
+        emitted.extend(miner._process_item(i)[0] for i in miner._build_iterator(now+60000))
+
+        # the server handlers wait on the kept alive connections
+        miner._session.close()
+
+    finally:
+        server.stop()
+
+    expected = []
+    for package in packages:
+        expected.extend(taxiing.stix.decode(package, ip_version_auto_detect=True)[1])
+
+    assert_equal(len(emitted), 2*len(expected))
+    assert_equal(indicator_set(emitted), set((i['indicator'], i['type']) for i in expected))
+    # the poll service is discovered once
+    assert_equal(miner.statistics['discovery.count'], 1)
+    assert_equal(miner.statistics['poll.parts'], 2*server.num_parts)
@@ -17,21 +17,44 @@
 import os
 import os.path
 import json
+import pickle
 
 from unittest import TestCase
 from nose.tools import assert_items_equal, assert_equal
 from parameterized import parameterized
+from lxml import etree
+from netaddr import IPAddress
 
 import taxiing.stix
+from taxiing.stix.addressobject import ip_version
+from taxiing.stix.indicator import Indicator
 
 TestCase.maxDiff = None
 MYDIR = os.path.dirname(__file__)
 
+ADDRESS_PACKAGE = '''<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" xmlns:cybox="http://cybox.mitre.org/cybox-2"
+    xmlns:AddressObj="http://cybox.mitre.org/objects#AddressObject-2"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" id="example:package-1" version="1.1.1">
+    <stix:Observables cybox_major_version="2" cybox_minor_version="1">
+        <cybox:Observable id="example:observable-1">
+            <cybox:Object>
+                <cybox:Properties xsi:type="AddressObj:AddressObjectType" category="{}">
+                    <AddressObj:Address_Value>{}</AddressObj:Address_Value>
+                </cybox:Properties>
+            </cybox:Object>
+        </cybox:Observable>
+    </stix:Observables>
+</stix:STIX_Package>'''
+
 
 def stix_results_file(fname):
     return fname.rsplit('.', 1)[0]+'_result.json'
 
 
+def as_dicts(indicators):
+    return [i.as_dict() for i in indicators]
+
+
 def load_stix_vectors():
     testfiles = os.listdir(MYDIR)
     testfiles = filter(
@@ -58,7 +81,42 @@ def test_stixdecoder(testfile):
         results = json.load(f)
 
     assert_items_equal(
-        taxiing.stix.decode(spackage)[1],
+        as_dicts(taxiing.stix.decode(spackage)[1]),
+        results
+    )
+
+
+@parameterized(load_stix_vectors)
+def test_stixdecoder_unicode(testfile):
+    with open(testfile, 'r') as f:
+        spackage = f.read().decode('utf-8')
+
+    with open(stix_results_file(testfile)) as f:
+        results = json.load(f)
+
+    assert_items_equal(
+        as_dicts(taxiing.stix.decode(spackage)[1]),
+        results
+    )
+
+
+@parameterized(load_stix_vectors)
+def test_stixdecoder_element(testfile):
+    with open(testfile, 'r') as f:
+        spackage = f.read()
+
+    with open(stix_results_file(testfile)) as f:
+        results = json.load(f)
+
+    # wrap the package in a TAXII Content_Block like in a Poll_Response
+    content_block = etree.fromstring(
+        '<taxii_11:Content_Block xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1">'
+        '<taxii_11:Content/></taxii_11:Content_Block>'
+    )
+    content_block[0].append(etree.fromstring(spackage))
+
+    assert_items_equal(
+        as_dicts(taxiing.stix.decode_element(content_block[0][0])[1]),
         results
     )
 
@@ -68,3 +126,60 @@ def test_parse_stix_timestamp():
         taxiing.stix._parse_stix_timestamp('2017-11-06T12:12:19.000000+00:00'),
         1509970339000
     )
+
+
+def test_indicator_record():
+    package = {'share_level': 'green', 'stix_package_title': 'package'}
+    observable = {'stix_title': 'observable'}
+    i = Indicator({'indicator': '1.1.1.1', 'type': 'IPv4'}, observable, package)
+
+    assert_equal(i['indicator'], '1.1.1.1')
+    assert_equal(i.get('share_level'), 'green')
+    assert_equal(i.get('confidence'), None)
+    assert_equal(i.as_dict(), {
+        'indicator': '1.1.1.1',
+        'type': 'IPv4',
+        'share_level': 'green',
+        'stix_package_title': 'package',
+        'stix_title': 'observable'
+    })
+
+    i2 = pickle.loads(pickle.dumps(i, pickle.HIGHEST_PROTOCOL))
+    assert_equal(i2.as_dict(), i.as_dict())
+
+    # merging does not touch the shared property sets
+    i.update(Indicator({'indicator': '1.1.1.1', 'type': 'IPv4', 'share_level': 'red'}))
+    assert_equal(i['share_level'], 'red')
+    assert_equal(i['stix_title'], 'observable')
+    assert_equal(package['share_level'], 'green')
+
+
+@parameterized([
+    ('10.1.2.3',), ('255.255.255.255',), ('256.1.1.1',), ('010.0.0.1',),
+    ('09.1.1.1',), ('10.1',), ('0x0a000001',), ('1.2.3.4 ',), (' 1.2.3.4',),
+    ('1.2.3.4/24',), ('::1',), ('::ffff:1.2.3.4',), ('2001:db8::1:2',),
+    ('fe80::1%eth0',), ('1:2:3:4:5:6:7:8:9',), ('user@example.com',), ('',)
+])
+def test_ip_version(value):
+    try:
+        expected = IPAddress(value).version
+    except Exception:
+        expected = None
+
+    assert_equal(ip_version(value), expected)
+
+
+@parameterized([
+    ('ipv4-addr', '2001:db8::1', False, 'IPv4'),
+    ('ipv4-addr', '2001:db8::1', True, 'IPv6'),
+    ('ipv6-addr', '10.1.2.3', True, 'IPv4'),
+    ('e-mail', 'user@example.com', False, 'email-addr'),
+    ('e-mail', 'user@example.com', True, 'email-addr')
+])
+def test_ip_version_auto_detect(category, value, ip_version_auto_detect, type_):
+    _, indicators = taxiing.stix.decode(
+        ADDRESS_PACKAGE.format(category, value),
+        ip_version_auto_detect=ip_version_auto_detect
+    )
+
+    assert_equal([(i['indicator'], i['type']) for i in indicators], [(value, type_)])
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2016 Palo Alto Networks, Inc
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import resource
+from io import BytesIO
+
+from nose.tools import assert_equal, assert_less
+from nose.plugins.skip import SkipTest
+from lxml import etree
+
+import taxiing.taxii.v11 as taxii11
+
+POLL_RESPONSE = '''<taxii_11:Poll_Response xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1"
+    message_id="1" in_response_to="2" collection_name="test" more="true" result_id="r1" result_part_number="1">
+    <taxii_11:Content_Block>
+        <taxii_11:Content_Binding binding_id="urn:stix.mitre.org:xml:1.1.1"/>
+        <taxii_11:Content>
+            <stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" xmlns:x="urn:example">
+                <x:Content_Block><taxii_11:Content_Block/></x:Content_Block>
+            </stix:STIX_Package>
+        </taxii_11:Content>
+        <taxii_11:Timestamp_Label>2017-11-06T12:12:19.000000+00:00</taxii_11:Timestamp_Label>
+    </taxii_11:Content_Block>
+    <taxii_11:Content_Block>
+        <taxii_11:Content/>
+    </taxii_11:Content_Block>
+</taxii_11:Poll_Response>'''
+
+STATUS_MESSAGE = '''<taxii_11:Status_Message xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1"
+    message_id="1" in_response_to="2" status_type="UNAUTHORIZED"/>'''
+
+# each level expands to 10 copies of the previous one,
+# &lol7; would be 300MB of text
+ENTITY_EXPANSION = '''<?xml version="1.0"?>
+<!DOCTYPE taxii_11:Poll_Response [
+<!ENTITY lol0 "lollollollollollollollollollol">
+<!ENTITY lol1 "&lol0;&lol0;&lol0;&lol0;&lol0;&lol0;&lol0;&lol0;&lol0;&lol0;">
+<!ENTITY lol2 "&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;&lol1;">
+<!ENTITY lol3 "&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;">
+<!ENTITY lol4 "&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;">
+<!ENTITY lol5 "&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;">
+<!ENTITY lol6 "&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;">
+<!ENTITY lol7 "&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;">
+]>
+<taxii_11:Poll_Response xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1"
+    message_id="1" in_response_to="2" collection_name="test" more="false" result_id="r1" result_part_number="1">
+    <taxii_11:Content_Block>
+        <taxii_11:Content_Binding binding_id="urn:stix.mitre.org:xml:1.1.1"/>
+        <taxii_11:Content>
+            <stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1">&lol7;</stix:STIX_Package>
+        </taxii_11:Content>
+    </taxii_11:Content_Block>
+</taxii_11:Poll_Response>'''
+
+
+def test_iterparse_poll_response():
+    events = [
+        (action, element.tag, element.get('result_id', None))
+        for action, element in taxii11.iterparse_poll_response(BytesIO(POLL_RESPONSE))
+    ]
+
+    assert_equal(events, [
+        ('start', taxii11.POLL_RESPONSE, 'r1'),
+        ('end', taxii11.CONTENT_BLOCK, None),
+        ('end', taxii11.CONTENT_BLOCK, None)
+    ])
+
+
+def test_iterparse_poll_response_entities():
+    # entities are not expanded
+    blocks = [
+        etree.tostring(element)
+        for _, element in taxii11.iterparse_poll_response(BytesIO(ENTITY_EXPANSION))
+        if element.tag == taxii11.CONTENT_BLOCK
+    ]
+
+    assert_equal(len(blocks), 1)
+    assert_less(len(blocks[0]), 1024)
+
+
+def test_poll_response_more():
+    assert_equal(taxii11.poll_response_more(BytesIO(POLL_RESPONSE)), True)
+    assert_equal(taxii11.poll_response_more(BytesIO(STATUS_MESSAGE)), False)
+
+
+def test_poll_request_response_type():
+    begin = taxii11.EPOCH
+    end = taxii11.EPOCH
+
+    assert '<taxii_11:Response_Type>FULL</taxii_11:Response_Type>' in taxii11.poll_request('c', begin, end)
+    assert '<taxii_11:Response_Type>COUNT_ONLY</taxii_11:Response_Type>' in \
+        taxii11.poll_request('c', begin, end, response_type='COUNT_ONLY')
+
+
+def test_parse_record_count():
+    poll_response = '<taxii_11:Poll_Response xmlns:taxii_11="{}" message_id="1" in_response_to="1" collection_name="c" more="false">{{}}</taxii_11:Poll_Response>'.format(taxii11.NAMESPACE)
+
+    assert_equal(
+        taxii11.parse_record_count(poll_response.format('<taxii_11:Record_Count>42</taxii_11:Record_Count>')),
+        (42, False)
+    )
+    assert_equal(
+        taxii11.parse_record_count(poll_response.format('<taxii_11:Record_Count partial_count="true">10000</taxii_11:Record_Count>')),
+        (10000, True)
+    )
+    assert_equal(taxii11.parse_record_count(poll_response.format('')), None)
+    assert_equal(taxii11.parse_record_count(poll_response.format('<taxii_11:Record_Count>x</taxii_11:Record_Count>')), None)
+    assert_equal(
+        taxii11.parse_record_count(
+            '<taxii_11:Status_Message xmlns:taxii_11="{}" message_id="1" in_response_to="1" status_type="UNSUPPORTED_MESSAGE"/>'.format(taxii11.NAMESPACE)
+        ),
+        None
+    )
+
+
+def test_poll_request_allow_asynch():
+    assert 'allow_asynch="false"' in taxii11.poll_request('c', taxii11.EPOCH, taxii11.EPOCH)
+    assert 'allow_asynch="true"' in taxii11.poll_request('c', taxii11.EPOCH, taxii11.EPOCH, allow_asynch=True)
+
+
+def test_parse_status_detail():
+    status_message = etree.fromstring(
+        '<taxii_11:Status_Message xmlns:taxii_11="{}" message_id="1" in_response_to="1" status_type="PENDING">'
+        '<taxii_11:Status_Detail>'
+        '<taxii_11:Detail name="ESTIMATED_WAIT">30</taxii_11:Detail>'
+        '<taxii_11:Detail name="RESULT_ID"> r1 </taxii_11:Detail>'
+        '<taxii_11:Detail name="WILL_PUSH">false</taxii_11:Detail>'
+        '</taxii_11:Status_Detail>'
+        '</taxii_11:Status_Message>'.format(taxii11.NAMESPACE)
+    )
+
+    assert_equal(
+        taxii11.parse_status_detail(status_message),
+        {'ESTIMATED_WAIT': '30', 'RESULT_ID': 'r1', 'WILL_PUSH': 'false'}
+    )
+
+
+def test_iterparse_status_message():
+    events = [
+        (element.tag, element.get('status_type'))
+        for _, element in taxii11.iterparse_poll_response(BytesIO(STATUS_MESSAGE))
+    ]
+
+    assert_equal(events, [(taxii11.STATUS_MESSAGE, 'UNAUTHORIZED')])
+
+
+class SyntheticPollResponse(object):
+    # file-like object generating a Poll_Response with num_blocks
+    # Content_Blocks on the fly
+    CONTENT_BLOCK = (
+        '<taxii_11:Content_Block><taxii_11:Content>'
+        '<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" id="package-{}">'
+        '<stix:STIX_Header><stix:Title>{}</stix:Title></stix:STIX_Header>'
+        '</stix:STIX_Package></taxii_11:Content>'
+        '<taxii_11:Timestamp_Label>2017-11-06T12:12:19Z</taxii_11:Timestamp_Label>'
+        '</taxii_11:Content_Block>\n'
+    )
+
+    def __init__(self, num_blocks):
+        self.num_blocks = num_blocks
+        self.buffer = '<taxii_11:Poll_Response xmlns:taxii_11="{}" more="false">'.format(taxii11.NAMESPACE)
+        self.done = False
+
+    def read(self, size):
+        while len(self.buffer) < size and not self.done:
+            if self.num_blocks == 0:
+                self.buffer += '</taxii_11:Poll_Response>'
+                self.done = True
+                continue
+
+            self.num_blocks -= 1
+            self.buffer += self.CONTENT_BLOCK.format(self.num_blocks, 'x'*200)
+
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+
+def _rss():
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1])*resource.getpagesize()
+
+
+def test_iterparse_poll_response_memory():
+    if not os.path.exists('/proc/self/statm'):
+        raise SkipTest('/proc/self/statm not available')
+
+    # ~70MB response, if processed Content_Blocks stayed attached
+    # to the Poll_Response memory would grow with it
+    num_blocks = 200000
+    ceiling = 8*1024*1024
+
+    initial_rss = None
+    peak_rss = 0
+    count = 0
+    for _, element in taxii11.iterparse_poll_response(SyntheticPollResponse(num_blocks)):
+        if element.tag != taxii11.CONTENT_BLOCK:
+            continue
+
+        count += 1
+        if count == 1000:
+            initial_rss = _rss()
+        elif count % 1000 == 0:
+            peak_rss = max(peak_rss, _rss())
+
+    assert_equal(count, num_blocks)
+    assert_less(peak_rss-initial_rss, ceiling)
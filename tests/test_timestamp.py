@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+#  Copyright 2016 Palo Alto Networks, Inc
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+
+from nose.tools import assert_equal, assert_is_none, assert_raises
+from parameterized import parameterized
+
+import taxiing.timestamp
+from taxiing.timestamp import parse_timestamp
+
+
+@parameterized([
+    ('2017-11-06T12:12:19.000000+00:00',),
+    ('2017-11-06T12:12:19Z',),
+    ('2017-11-06T12:12:19',),
+    ('2017-11-06 12:12:19',),
+    ('2017-11-06T12:12:19.5Z',),
+    ('2017-11-06T12:12:19.123456789+00:00',),
+    ('2017-11-06T12:12:19.999999Z',),
+    ('2017-11-06T12:12:19+05:30',),
+    ('2017-11-06T12:12:19+0530',),
+    ('2017-11-06T12:12:19-05',),
+    ('2017-11-06T00:00:00.001-11:45',),
+    ('1969-12-31T23:59:59.999Z',),
+    ('2016-02-29T23:59:59.999999+14:00',),
+    (u'2017-11-06T12:12:19.000Z',),
+    # handled by dateutil
+    ('2017-11-06',),
+    ('Mon, 06 Nov 2017 12:12:19 +0100',),
+    ('2017-11-06T12:12:19 UTC',)
+])
+def test_parse_timestamp(timestamp):
+    assert_equal(
+        parse_timestamp(timestamp),
+        taxiing.timestamp._dateutil_ms(timestamp)
+    )
+
+
+def test_parse_timestamp_random():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        timestamp = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{}{}'.format(
+            rnd.randint(1970, 2100), rnd.randint(1, 12), rnd.randint(1, 28),
+            rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59),
+            rnd.randint(0, 10**9), rnd.choice(['', 'Z', '+01:00', '-0930', '+03'])
+        )
+        assert_equal(
+            taxiing.timestamp._iso8601_ms(timestamp),
+            taxiing.timestamp._dateutil_ms(timestamp)
+        )
+
+
+def test_parse_timestamp_invalid():
+    assert_is_none(taxiing.timestamp._iso8601_ms('2017-02-30T12:12:19Z'))
+    assert_is_none(taxiing.timestamp._iso8601_ms('2016-12-31T23:59:60Z'))
+    assert_raises(ValueError, parse_timestamp, '2017-02-30T12:12:19Z')
+
+
+def test_parse_timestamp_memo():
+    taxiing.timestamp._memo.clear()
+    for n in range(taxiing.timestamp.MEMO_SIZE+10):
+        parse_timestamp('2017-11-06T12:12:19.{:06d}Z'.format(n))
+
+    assert_equal(len(taxiing.timestamp._memo), 10)
+    assert_equal(parse_timestamp('2017-11-06T12:12:19.000009Z'), 1509970339000)